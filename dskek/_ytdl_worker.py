@@ -0,0 +1,41 @@
+"""What runs inside an extraction worker.
+
+Kept apart from the rest of the bot: with YTDL_WORKER_PROCESSES each spawned
+worker imports this module, and it must not pull in discord, the caches or
+the gemini client along the way.
+"""
+import threading
+import yt_dlp
+
+
+# each worker thread (or process) gets its own YoutubeDL; the object isn't thread-safe
+_worker = threading.local()
+
+
+def init_worker(options: dict):
+    _worker.ytdl = yt_dlp.YoutubeDL(options)
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def extract(url: str, download: bool, directory: str | None = None) -> dict:
+    ytdl = _worker.ytdl
+    paths = ytdl.params.get('paths', {})
+    if directory:
+        # this job only: the worker's YoutubeDL serves everyone else afterwards
+        ytdl.params['paths'] = {'home': directory}
+    try:
+        data = ytdl.extract_info(url, download=download)
+        if 'entries' in data:
+            data = data['entries'][0]
+        if directory:
+            data['filepath'] = ytdl.prepare_filename(data)
+    except Exception as e:
+        # yt-dlp's errors drag unpicklable state along
+        raise ExtractionError(str(e)) from None
+    finally:
+        ytdl.params['paths'] = paths
+    # plain dicts only: results may have to cross a process boundary
+    return ytdl.sanitize_info(data)
@@ -0,0 +1,374 @@
+"""
+Offline replay benchmark for the voice pipeline.
+
+Feeds recorded or synthetic PCM into VoiceBot.write for N users in each of
+G guilds, runs AudioLoop against a local stand-in for the Gemini Live
+session and drains VoiceBot.read from a simulated 20 ms player clock.
+
+    python -m dskek.bench --guilds 4 --users 3 --duration 30 --speed 0
+"""
+
+import os
+
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+import argparse
+import asyncio
+import gc
+import json
+import threading
+import time
+
+import numpy as np
+
+from dskek.channels import Stream
+from dskek.converters import AudioType, convert_pcm
+from dskek.metrics import Histogram
+from dskek.receive import receive_workers
+from dskek.voicebot import VoiceBot
+
+
+FRAME_MS = 20
+RTP_FRAME_SAMPLES = 960
+REPLY_REALTIME_FACTOR = 2
+
+
+def synthetic_speech(duration_ms: int, talk_ms: int, pause_ms: int, seed: int) -> list[bytes]:
+    """Alternating bursts of voiced noise and silence, as 20 ms Discord frames."""
+    rng = np.random.default_rng(seed)
+    info = AudioType.DISCORD.value
+    samples_per_frame = info.sample_rate // 1000 * FRAME_MS
+    frames = []
+    period = talk_ms + pause_ms
+    for index in range(duration_ms // FRAME_MS):
+        if (index * FRAME_MS + seed * 137) % period < talk_ms:
+            t = (np.arange(samples_per_frame) + index * samples_per_frame) / info.sample_rate
+            voice = 4000 * np.sin(2 * np.pi * (140 + 40 * seed) * t)
+            voice += rng.normal(0, 800, samples_per_frame)
+            mono = np.clip(voice, -32768, 32767).astype(np.int16)
+        else:
+            mono = rng.normal(0, 20, samples_per_frame).astype(np.int16)
+        frames.append(np.repeat(mono[:, None], info.channels, axis=1).tobytes())
+    return frames
+
+
+def recorded_speech(path: str) -> list[bytes]:
+    """Raw s16le 48 kHz stereo PCM, split into 20 ms frames."""
+    chunk = AudioType.DISCORD.value.chunk_size
+    with open(path, "rb") as f:
+        data = f.read()
+    return [data[i : i + chunk] for i in range(0, len(data) - chunk + 1, chunk)]
+
+
+def encode_opus(frames: list[bytes]) -> list[bytes]:
+    """What discord would send us for these frames, for opus-mode runs."""
+    import discord
+
+    encoder = discord.opus.Encoder()
+    return [encoder.encode(frame, encoder.SAMPLES_PER_FRAME) for frame in frames]
+
+
+class FakeLiveSession:
+    """Stand-in for a Gemini Live session: answers every audio_stream_end
+    with audio after a configurable delay."""
+
+    def __init__(self, reply_delay_ms: int, reply_mode: str, reply_ms: int, reply_speed: float):
+        self.reply_delay = reply_delay_ms / 1000
+        self.reply_mode = reply_mode
+        self.reply_ms = reply_ms
+        self.reply_speed = reply_speed
+        self._utterance = bytearray()
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._tasks: set[asyncio.Task] = set()
+        self._replying: asyncio.Task | None = None
+        self.received_bytes = 0
+        self.messages = 0
+        self.replies = 0
+        self.interruptions = 0
+
+    async def send_realtime_input(self, *, audio=None, audio_stream_end=None, text=None, **kwargs):
+        self.messages += 1
+        if audio is not None:
+            self.received_bytes += len(audio["data"])
+            self._utterance.extend(audio["data"])
+            if self._replying and not self._replying.done():
+                # speech while answering: stop like the real server does
+                self._replying.cancel()
+                self.interruptions += 1
+                await self._outbox.put(self._message(interrupted=True))
+                await self._outbox.put(self._message(turn_complete=True))
+        if audio_stream_end:
+            utterance = bytes(self._utterance)
+            self._utterance.clear()
+            task = self._replying = asyncio.create_task(self._reply(utterance))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def send(self, *, input=None, **kwargs):
+        self.messages += 1
+
+    def _reply_audio(self, utterance: bytes) -> bytes:
+        receive = AudioType.GEMINI_RECEIVE.value
+        if self.reply_mode == "echo" and utterance:
+            return convert_pcm(utterance, AudioType.GEMINI_SEND.value, receive)
+        t = np.arange(receive.sample_rate * self.reply_ms // 1000) / receive.sample_rate
+        return (3000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16).tobytes()
+
+    async def _reply(self, utterance: bytes):
+        await asyncio.sleep(self.reply_delay)
+        audio = self._reply_audio(utterance)
+        chunk = AudioType.GEMINI_RECEIVE.value.bytes_per_ms * 40
+        for start in range(0, len(audio), chunk):
+            await self._outbox.put(self._message(data=audio[start : start + chunk]))
+            if self.reply_speed:
+                # the real server streams faster than real time
+                await asyncio.sleep(0.04 / self.reply_speed / REPLY_REALTIME_FACTOR)
+        await self._outbox.put(self._message(turn_complete=True))
+        self.replies += 1
+
+    @staticmethod
+    def _message(data: bytes | None = None, turn_complete: bool = False, interrupted: bool = False):
+        return SimpleNamespace(
+            data=data,
+            text=None,
+            server_content=SimpleNamespace(
+                turn_complete=turn_complete, interrupted=interrupted, generation_complete=None
+            ),
+            session_resumption_update=None,
+            go_away=None,
+        )
+
+    async def receive(self):
+        while True:
+            msg = await self._outbox.get()
+            yield msg
+            if msg.server_content.turn_complete:
+                return
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+
+@dataclass
+class GuildRun:
+    voice: VoiceBot
+    session: FakeLiveSession
+    frames_written: int = 0
+    frames_played: int = 0
+    silent_frames: int = 0
+    gaps: int = 0
+    task: asyncio.Task | None = None
+    threads: list[threading.Thread] = field(default_factory=list)
+
+
+def feed(run: GuildRun, users: list[list[bytes]], frames: int, tick: float, start: float):
+    bases = [1000 + 7919 * i for i in range(len(users))]
+    for index in range(frames):
+        for user_id, signal in enumerate(users, start=1):
+            frame = signal[index % len(signal)]
+            packet = SimpleNamespace(
+                timestamp=bases[user_id - 1] + index * RTP_FRAME_SAMPLES, sequence=index & 0xFFFF
+            )
+            if run.voice.opus:
+                data = SimpleNamespace(pcm=b"", opus=frame, packet=packet)
+            else:
+                data = SimpleNamespace(pcm=frame, packet=packet)
+            run.voice.write(SimpleNamespace(id=user_id), data)
+            run.frames_written += 1
+        if tick:
+            delay = start + (index + 1) * tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def play(run: GuildRun, stop: threading.Event, tick: float, start: float):
+    playing = False
+    index = 0
+    while not stop.is_set():
+        had_audio = len(run.voice.playback) > 0
+        barge_ins = run.voice.stream.barge_ins
+        run.voice.read()
+        if run.voice.stream.barge_ins != barge_ins:
+            # playback was cut on purpose, not starved
+            had_audio = playing = False
+        run.frames_played += 1
+        if had_audio:
+            playing = True
+        else:
+            run.silent_frames += 1
+            if playing:
+                run.gaps += 1
+                playing = False
+        index += 1
+        delay = start + index * tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class GCWatch:
+    """Collections per generation and time spent in them while installed."""
+
+    def __init__(self):
+        self.collections = [0, 0, 0]
+        self.pause_ms = 0.0
+        self.max_pause_ms = 0.0
+        self._started = 0.0
+
+    def start(self):
+        gc.callbacks.append(self._callback)
+
+    def stop(self):
+        gc.callbacks.remove(self._callback)
+
+    def _callback(self, phase: str, info: dict):
+        if phase == "start":
+            self._started = time.perf_counter()
+            return
+        pause = (time.perf_counter() - self._started) * 1000
+        self.collections[info["generation"]] += 1
+        self.pause_ms += pause
+        self.max_pause_ms = max(self.max_pause_ms, pause)
+
+
+def merge(histograms: list[Histogram]) -> Histogram:
+    total = Histogram(histograms[0].name, histograms[0].help, histograms[0].buckets)
+    for histogram in histograms:
+        total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+        total.count += histogram.count
+        total.sum += histogram.sum
+    return total
+
+
+async def bench(args) -> dict:
+    frames = args.duration * 1000 // FRAME_MS
+    tick = FRAME_MS / 1000 / args.speed if args.speed else 0.0
+    runs: list[GuildRun] = []
+    for guild in range(args.guilds):
+        session = FakeLiveSession(args.reply_delay_ms, args.reply_mode, args.reply_ms, args.speed)
+
+        @asynccontextmanager
+        async def connect(session=session):
+            try:
+                yield session
+            finally:
+                session.close()
+
+        voice = VoiceBot(Stream(transport=args.transport), connect=connect, opus=args.opus)
+        runs.append(GuildRun(voice=voice, session=session))
+
+    if args.pcm:
+        recorded = recorded_speech(args.pcm)
+        users = [recorded[i * 50 :] + recorded[: i * 50] for i in range(args.users)]
+    else:
+        users = [
+            synthetic_speech(args.duration * 1000, args.talk_ms, args.pause_ms, seed)
+            for seed in range(args.users)
+        ]
+    if args.opus:
+        users = [encode_opus(signal) for signal in users]
+
+    stop = threading.Event()
+    gc_watch = GCWatch()
+    gc_watch.start()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for run in runs:
+        run.task = asyncio.create_task(run.voice.run())
+        run.threads = [
+            threading.Thread(target=feed, args=(run, users, frames, tick, wall_start), daemon=True),
+            # playback can't outrun the wall clock of a real voice client
+            threading.Thread(target=play, args=(run, stop, tick or FRAME_MS / 1000, wall_start), daemon=True),
+        ]
+        for thread in run.threads:
+            thread.start()
+
+    while any(run.threads[0].is_alive() for run in runs):
+        await asyncio.sleep(0.05)
+    feed_wall = time.perf_counter() - wall_start
+    # let the last replies arrive and play out
+    await asyncio.sleep(args.drain)
+    stop.set()
+    for run in runs:
+        run.task.cancel()
+    await asyncio.gather(*(run.task for run in runs), return_exceptions=True)
+    for run in runs:
+        run.threads[1].join()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    gc_watch.stop()
+
+    stages = {}
+    for index, name in enumerate(h.name for h in runs[0].voice.stream.metrics.histograms):
+        total = merge([run.voice.stream.metrics.histograms[index] for run in runs])
+        stages[name] = {"count": total.count, "p50": total.quantile(0.5), "p99": total.quantile(0.99)}
+
+    replies = sum(run.session.replies for run in runs)
+    interruptions = sum(run.session.interruptions for run in runs)
+    return {
+        "guilds": args.guilds,
+        "users": args.users,
+        "opus": args.opus,
+        "transport": args.transport,
+        "audio_seconds": args.duration,
+        "wall_seconds": round(wall, 3),
+        "write_fps": round(sum(run.frames_written for run in runs) / feed_wall, 1),
+        "read_fps": round(sum(run.frames_played for run in runs) / wall, 1),
+        "cpu_seconds_per_session": round(cpu / args.guilds, 3),
+        "cpu_percent_per_session": round(100 * cpu / wall / args.guilds, 2),
+        "upstream_messages": sum(run.session.messages for run in runs),
+        "upstream_bytes": sum(run.session.received_bytes for run in runs),
+        "dropped_in_ms": sum(run.voice.stream.dropped["in_ms"] for run in runs),
+        "replies": replies,
+        "interruptions": interruptions,
+        "barge_ins": sum(run.voice.stream.barge_ins for run in runs),
+        "barge_in_discarded_ms": sum(run.voice.stream.discarded_ms for run in runs),
+        # one gap per reply is just the end of that reply
+        "underruns": max(0, sum(run.gaps for run in runs) - replies),
+        "playback_underruns": sum(run.voice.playback.underruns for run in runs),
+        "gc_collections": gc_watch.collections,
+        "gc_pause_ms": round(gc_watch.pause_ms, 2),
+        "gc_max_pause_ms": round(gc_watch.max_pause_ms, 2),
+        "stages": stages,
+        "receive_workers": receive_workers.summary().splitlines(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--users", type=int, default=2)
+    parser.add_argument("--duration", type=int, default=20, help="seconds of audio per user")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = real time, 0 = as fast as possible")
+    parser.add_argument("--pcm", help="raw s16le 48 kHz stereo file to replay instead of synthetic speech")
+    parser.add_argument("--talk-ms", type=int, default=2_000)
+    parser.add_argument("--pause-ms", type=int, default=3_000)
+    parser.add_argument("--reply-delay-ms", type=int, default=300)
+    parser.add_argument("--reply-mode", choices=("echo", "tone"), default="tone")
+    parser.add_argument("--reply-ms", type=int, default=1_500)
+    parser.add_argument("--drain", type=float, default=3.0, help="seconds to wait for replies after feeding")
+    parser.add_argument("--transport", choices=("queue", "ring"), default="queue")
+    parser.add_argument("--opus", action="store_true", help="feed Opus packets and decode them like a live session")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    report = asyncio.run(bench(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    stages = report.pop("stages")
+    workers = report.pop("receive_workers")
+    for key, value in report.items():
+        print(f"{key:>26}: {value}")
+    print(f"{'stage':>26}  {'count':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, stage in stages.items():
+        print(f"{name:>26}  {stage['count']:>7} {stage['p50']!s:>8} {stage['p99']!s:>8}")
+    for line in workers:
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,550 @@
 import asyncio
-from collections import defaultdict
+from collections import defaultdict, deque
+from enum import Enum
+from typing import Callable
+import ctypes
+import logging
 import queue
+import threading
+import time
 import culsans
+from dskek.converters import AudioData, AudioType, Resampler
+from dskek.env import STREAM_TRANSPORT
+from dskek.metrics import StreamMetrics
+
+
+logger = logging.getLogger("discord")
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = "drop-oldest"
+    DROP_NEWEST = "drop-newest"
+    BLOCK = "block"
+
+
+# upstream: if Gemini stalls, keep only the latest speech
+IN_CAPACITY_MS = 2_000
+IN_POLICY = OverflowPolicy.DROP_OLDEST
+# downstream: slow the receiver down rather than cut the answer short
+OUT_CAPACITY_MS = 20_000
+OUT_POLICY = OverflowPolicy.BLOCK
+BLOCK_TIMEOUT = 10.0
+# the ring transport hands the player at most this much audio per read
+RING_READ_MS = 200
+
+
+def audio_ms(item) -> int:
+    return item.duration_ms if isinstance(item, AudioData) else 0
+
+
+class PCMRingBuffer:
+    """Preallocated byte ring that hands out fixed-size frames without copying."""
+
+    def __init__(self, capacity: int, frame_size: int):
+        self.capacity = capacity - capacity % frame_size
+        self.frame_size = frame_size
+        # the first frame is mirrored past the end, so a frame that wraps is
+        # still one contiguous slice; frames are handed out as ctypes arrays
+        # over the buffer, which the opus encoder accepts as-is
+        self._buffer = bytearray(self.capacity + frame_size)
+        self._view = memoryview(self._buffer)
+        self._frame_type = ctypes.c_char * frame_size
+        self._silence = self._frame_type()
+        self._partial = self._frame_type()
+        self._partial_view = memoryview(self._partial).cast("B")
+        self._read = 0
+        self._write = 0
+        self.underruns = 0
+        self._dry = True
+
+    def __len__(self):
+        return self._write - self._read
+
+    @property
+    def free(self) -> int:
+        # one frame of headroom: the frame handed out last may still be encoding
+        return self.capacity - self.frame_size - len(self)
+
+    def write(self, data: bytes | memoryview):
+        size = len(data)
+        if size > self.free:
+            raise BufferError(f"Ring buffer overflow: {size} bytes, {self.free} free")
+        pos = self._write % self.capacity
+        first = min(size, self.capacity - pos)
+        self._view[pos : pos + first] = data[:first]
+        if first < size:
+            self._view[: size - first] = data[first:]
+        self._mirror(pos, size)
+        self._write += size
+
+    def _mirror(self, pos: int, size: int):
+        # keep the tail copy of the first frame in sync
+        end = pos + size
+        if pos < self.frame_size:
+            stop = min(end, self.frame_size)
+            self._view[self.capacity + pos : self.capacity + stop] = self._view[pos:stop]
+        if end > self.capacity:
+            stop = min(end - self.capacity, self.frame_size)
+            self._view[self.capacity : self.capacity + stop] = self._view[:stop]
+
+    def read_frame(self, expecting: bool = False):
+        """Next frame, padded with silence if the ring runs dry. Running dry
+        while more audio is `expecting` counts as one underrun per gap."""
+        available = len(self)
+        if available >= self.frame_size:
+            pos = self._read % self.capacity
+            self._read += self.frame_size
+            self._dry = False
+            return self._frame_type.from_buffer(self._buffer, pos)
+        if expecting and not self._dry:
+            self.underruns += 1
+        self._dry = True
+        if not available:
+            return self._silence
+        # tail of a turn: pad what is left with silence
+        pos = self._read % self.capacity
+        ctypes.memset(self._partial, 0, self.frame_size)
+        self._partial_view[:available] = self._view[pos : pos + available]
+        self._read += available
+        return self._partial
+
+    def clear(self):
+        self._read = self._write
+
+
+class AudioQueue(culsans.Queue):
+    """culsans queue measured in milliseconds of audio, with an overflow policy.
+
+    Control items (speech events, text) weigh nothing and are never dropped.
+    """
+
+    def __init__(self, capacity_ms: int, policy: OverflowPolicy, timeout: float = BLOCK_TIMEOUT):
+        super().__init__(capacity_ms, sizer=audio_ms)
+        self.policy = policy
+        self.timeout = timeout
+        self.dropped = 0
+        self.dropped_ms = 0
+
+    def _init(self, maxsize: int):
+        self._items = deque()
+
+    def _qsize(self) -> int:
+        return len(self._items)
+
+    def _put(self, item):
+        self._items.append(item)
+
+    def _get(self):
+        return self._items.popleft()
+
+    def _peekable(self) -> bool:
+        return True
+
+    def _peek(self):
+        return self._items[0]
+
+    def _clearable(self) -> bool:
+        return True
+
+    def _clear(self):
+        self._items.clear()
+
+    def _count_drop(self, item):
+        self.dropped += 1
+        self.dropped_ms += audio_ms(item)
+
+    def _evict(self, needed: int):
+        # drop the oldest audio until `needed` ms fit, keeping control items in order
+        with self.mutex:
+            kept = deque()
+            while self._items and self._size + needed > self.maxsize:
+                item = self._items.popleft()
+                if isinstance(item, AudioData):
+                    self._size -= audio_ms(item)
+                    self._count_drop(item)
+                else:
+                    kept.append(item)
+            kept.extend(self._items)
+            self._items = kept
+
+    def offer(self, item) -> bool:
+        """Put from a plain thread (or a non-blocking caller), applying the policy."""
+        try:
+            self.put_nowait(item)
+            return True
+        except culsans.QueueFull:
+            pass
+        if self.policy is OverflowPolicy.DROP_OLDEST:
+            self._evict(audio_ms(item))
+            try:
+                self.put_nowait(item)
+                return True
+            except culsans.QueueFull:
+                pass
+        elif self.policy is OverflowPolicy.BLOCK:
+            try:
+                self.sync_put(item, timeout=self.timeout)
+                return True
+            except culsans.QueueFull:
+                pass
+        self._count_drop(item)
+        return False
+
+    async def async_offer(self, item) -> bool:
+        """Same as offer(), but blocks the coroutine instead of the thread."""
+        if self.policy is not OverflowPolicy.BLOCK:
+            return self.offer(item)
+        try:
+            await asyncio.wait_for(self.async_put(item), self.timeout)
+            return True
+        except TimeoutError:
+            self._count_drop(item)
+            return False
+
+
+class RingEmpty(asyncio.QueueEmpty, queue.Empty):
+    """Raised by a ring queue, whichever side of the thread boundary reads it."""
+
+
+def _resolve(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class SPSCRing:
+    """Lock-free byte ring for exactly one producer and one consumer.
+
+    Each side only ever advances its own offset, which the GIL makes safe
+    without a lock. The side running on the event loop can await the other
+    one; it gets woken at most once per wait, not once per write.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._read = 0
+        self._write = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._waiter: asyncio.Future | None = None
+        self.high_water = 0
+        self.wakeups = 0
+
+    def __len__(self):
+        return self._write - self._read
+
+    @property
+    def free(self) -> int:
+        return self.capacity - len(self)
+
+    @property
+    def read_offset(self) -> int:
+        return self._read
+
+    @property
+    def write_offset(self) -> int:
+        return self._write
+
+    def write(self, data: bytes | memoryview) -> int:
+        """Copy in as much of data as fits, returning how much that was."""
+        size = min(len(data), self.free)
+        pos = self._write % self.capacity
+        first = min(size, self.capacity - pos)
+        self._view[pos : pos + first] = data[:first]
+        if first < size:
+            self._view[: size - first] = data[first:size]
+        self._write += size
+        if len(self) > self.high_water:
+            self.high_water = len(self)
+        self.wake()
+        return size
+
+    def read_into(self, out: bytearray | memoryview) -> int:
+        size = min(len(out), len(self))
+        pos = self._read % self.capacity
+        first = min(size, self.capacity - pos)
+        out[:first] = self._view[pos : pos + first]
+        if first < size:
+            out[first:size] = self._view[: size - first]
+        self._read += size
+        self.wake()
+        return size
+
+    def wake(self):
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            self.wakeups += 1
+            self._loop.call_soon_threadsafe(_resolve, waiter)
+
+    async def wait(self, ready: Callable[[], bool], timeout: float | None = None) -> bool:
+        """Wait on the event loop until the other side makes ready() true."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while not ready():
+            self._loop = loop
+            waiter = self._waiter = loop.create_future()
+            # the other side may have moved before the waiter was visible
+            if ready():
+                self._waiter = None
+                break
+            remaining = None if deadline is None else deadline - loop.time()
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except TimeoutError:
+                self._waiter = None
+                return ready()
+        return True
+
+
+class RingAudioQueue:
+    """Queue-shaped front for an SPSCRing carrying one direction of a Stream.
+
+    Audio of a single type goes into the ring; control items and latency
+    stamps ride alongside as offsets into it, so they still come out in
+    order with the audio around them. Reads return whatever is buffered up
+    to the next control item as one AudioData. Only the consumer may move
+    the read offset, so overflowing audio is dropped as it arrives, unless
+    the policy blocks the (event loop) producer.
+    """
+
+    def __init__(
+        self,
+        capacity_ms: int,
+        atype: AudioType,
+        policy: OverflowPolicy = OverflowPolicy.DROP_NEWEST,
+        read_ms: int | None = None,
+        timeout: float = BLOCK_TIMEOUT,
+    ):
+        info = atype.value
+        self.atype = atype
+        self.policy = policy
+        self.timeout = timeout
+        self.ring = SPSCRing(capacity_ms * info.bytes_per_ms)
+        self._bytes_per_ms = info.bytes_per_ms
+        self._frame_size = info.frame_size
+        self._read_max = read_ms * info.bytes_per_ms if read_ms else self.ring.capacity
+        self._controls: deque[tuple[int, object]] = deque()
+        # (end offset, received, enqueued) for each write
+        self._stamps: deque[tuple[int, float, float]] = deque()
+        self.dropped = 0
+        self.dropped_ms = 0
+
+    # both ends use the same object, like culsans' sync_q/async_q pair
+    @property
+    def sync_q(self) -> "RingAudioQueue":
+        return self
+
+    @property
+    def async_q(self) -> "RingAudioQueue":
+        return self
+
+    @property
+    def fill_ms(self) -> int:
+        return len(self.ring) // self._bytes_per_ms
+
+    @property
+    def high_water_ms(self) -> int:
+        return self.ring.high_water // self._bytes_per_ms
+
+    def empty(self) -> bool:
+        return not len(self.ring) and not self._controls
+
+    def _write(self, data: bytes | memoryview, received: float):
+        # stamp first, the consumer may read the audio as soon as it's written
+        self._stamps.append((self.ring.write_offset + len(data), received, time.monotonic()))
+        self.ring.write(data)
+
+    def _check_type(self, item: AudioData):
+        if item.atype is not self.atype:
+            raise ValueError(f"This ring carries {self.atype.name} audio, got {item.atype.name}")
+
+    def offer(self, item) -> bool:
+        if not isinstance(item, AudioData):
+            self._controls.append((self.ring.write_offset, item))
+            self.ring.wake()
+            return True
+        self._check_type(item)
+        if len(item.data) > self.ring.free:
+            self.dropped += 1
+            self.dropped_ms += audio_ms(item)
+            return False
+        self._write(item.data, item.received)
+        return True
+
+    async def async_offer(self, item) -> bool:
+        if self.policy is not OverflowPolicy.BLOCK or not isinstance(item, AudioData):
+            return self.offer(item)
+        self._check_type(item)
+        data = memoryview(item.data)
+        while data:
+            if not await self.ring.wait(lambda: self.ring.free >= self._frame_size, self.timeout):
+                self.dropped += 1
+                self.dropped_ms += len(data) // self._bytes_per_ms
+                return False
+            size = min(len(data), self.ring.free)
+            self._write(data[: size - size % self._frame_size], item.received)
+            data = data[size - size % self._frame_size :]
+        return True
+
+    async def put(self, item):
+        self.offer(item)
+
+    def get_nowait(self):
+        start = self.ring.read_offset
+        if self._controls and self._controls[0][0] <= start:
+            return self._controls.popleft()[1]
+        end = self.ring.write_offset
+        if self._controls:
+            end = min(end, self._controls[0][0])
+        size = min(end - start, self._read_max)
+        size -= size % self._frame_size
+        if size <= 0:
+            raise RingEmpty
+        while self._stamps and self._stamps[0][0] <= start:
+            self._stamps.popleft()
+        _, received, enqueued = self._stamps[0] if self._stamps else (0, 0.0, 0.0)
+        data = bytearray(size)
+        self.ring.read_into(data)
+        return AudioData(data=memoryview(data), atype=self.atype, received=received, enqueued=enqueued)
+
+    async def get(self):
+        while True:
+            try:
+                return self.get_nowait()
+            except RingEmpty:
+                await self.ring.wait(lambda: not self.empty())
 
 
 class Stream:
-    def __init__(self):
-        self._in_queue = culsans.Queue()
-        self._out_queue = culsans.Queue()
+    def __init__(
+        self,
+        in_capacity_ms: int = IN_CAPACITY_MS,
+        in_policy: OverflowPolicy = IN_POLICY,
+        out_capacity_ms: int = OUT_CAPACITY_MS,
+        out_policy: OverflowPolicy = OUT_POLICY,
+        transport: str = STREAM_TRANSPORT,
+    ):
+        if transport == "ring":
+            # upstream audio is already in Gemini's format (see VoiceBot._send_mixed)
+            self._in_queue = RingAudioQueue(in_capacity_ms, AudioType.GEMINI_SEND)
+            self._out_queue = RingAudioQueue(out_capacity_ms, AudioType.DISCORD, out_policy, RING_READ_MS)
+        else:
+            self._in_queue = AudioQueue(in_capacity_ms, in_policy)
+            self._out_queue = AudioQueue(out_capacity_ms, out_policy)
         self.audio_in_queue = self._in_queue.async_q
         self.audio_out_queue = self._out_queue.sync_q
+        # stateful, so filter state survives chunk edges; upstream audio is
+        # converted by VoiceBot's own resampler on its receive worker
+        self.from_gemini = Resampler(AudioType.GEMINI_RECEIVE, AudioType.DISCORD)
+        self.metrics = StreamMetrics()
+        # barge-in: requested from the event loop or a voice thread,
+        # carried out by the player thread on its next frame
+        self._interrupted = threading.Event()
+        # ...and the receiver drops the rest of the response being played
+        self._cut_off = threading.Event()
+        self._discard_lock = threading.Lock()
+        self.barge_ins = 0
+        self.discarded_ms = 0
+        self.metrics.counters.update(
+            in_dropped_ms=lambda: self._in_queue.dropped_ms,
+            out_dropped_ms=lambda: self._out_queue.dropped_ms,
+            barge_ins=lambda: self.barge_ins,
+            barge_in_discarded_ms=lambda: self.discarded_ms,
+        )
+        if transport == "ring":
+            self.metrics.counters.update(
+                in_ring_wakeups=lambda: self._in_queue.ring.wakeups,
+                out_ring_wakeups=lambda: self._out_queue.ring.wakeups,
+            )
+            self.metrics.gauges.update(
+                in_ring_fill_ms=lambda: self._in_queue.fill_ms,
+                in_ring_high_water_ms=lambda: self._in_queue.high_water_ms,
+                out_ring_fill_ms=lambda: self._out_queue.fill_ms,
+                out_ring_high_water_ms=lambda: self._out_queue.high_water_ms,
+            )
+
+    def put_in(self, item) -> bool:
+        if isinstance(item, AudioData):
+            item.enqueued = time.monotonic()
+        return self._in_queue.offer(item)
+
+    async def put_out(self, item) -> bool:
+        if isinstance(item, AudioData):
+            item.enqueued = time.monotonic()
+        return await self._out_queue.async_offer(item)
+
+    def interrupt(self):
+        """Ask the player to drop everything queued for playback, and the
+        receiver to drop the rest of the current response."""
+        # set first: from here on nothing new of this response gets queued
+        self._cut_off.set()
+        self._interrupted.set()
+
+    @property
+    def cut_off(self) -> bool:
+        return self._cut_off.is_set()
+
+    def take_cut_off(self) -> bool:
+        if not self._cut_off.is_set():
+            return False
+        self._cut_off.clear()
+        return True
+
+    def take_interrupt(self) -> bool:
+        if not self._interrupted.is_set():
+            return False
+        self._interrupted.clear()
+        return True
+
+    def drain_out(self) -> int:
+        """Empty the playback queue, returning how many ms of audio it held."""
+        millis = 0
+        while True:
+            try:
+                item = self.audio_out_queue.get_nowait()
+            except queue.Empty:
+                return millis
+            millis += audio_ms(item)
+
+    def discard(self, millis: int):
+        if millis <= 0:
+            return
+        with self._discard_lock:
+            self.discarded_ms += millis
+
+    @property
+    def dropped(self) -> dict[str, int]:
+        return {
+            "in": self._in_queue.dropped,
+            "in_ms": self._in_queue.dropped_ms,
+            "out": self._out_queue.dropped,
+            "out_ms": self._out_queue.dropped_ms,
+        }
 
     def cleanup(self):
         # self.audio_in_queue.shutdown()
         # self.audio_out_queue.shutdown()
-        pass
+        self.from_gemini.reset()
 
 
 class StreamController:
     def __init__(self):
-        self.streams: dict[str, Stream] = defaultdict(Stream)
+        self.streams: dict[int, Stream] = defaultdict(Stream)
+
+    def create_stream(self, key: int) -> Stream:
+        stream = self.streams[key] = Stream()
+        return stream
+
+    def remove_stream(self, key: int):
+        if stream := self.streams.pop(key, None):
+            stream.cleanup()
+
+    def __contains__(self, key: int) -> bool:
+        return key in self.streams
 
-    def create_stream(self, key: str):
-        self.streams[key] = Stream()
+    def __len__(self) -> int:
+        return len(self.streams)
 
-    def __getitem__(self, key: str) -> Stream:
+    def __getitem__(self, key: int) -> Stream:
         return self.streams[key]
@@ -1,7 +1,11 @@
 from enum import Enum
 from dataclasses import dataclass
-from pydub import AudioSegment
 from io import BytesIO
+from typing import TYPE_CHECKING
+import numpy as np
+
+if TYPE_CHECKING:
+    from pydub import AudioSegment
 
 
 @dataclass
@@ -17,6 +21,14 @@ class AudioInfo:
         else:
             self.chunk_size = self.sample_rate // 50 * self.channels * self.sample_width
 
+    @property
+    def frame_size(self) -> int:
+        return self.channels * self.sample_width
+
+    @property
+    def bytes_per_ms(self) -> int:
+        return self.sample_rate // 1000 * self.frame_size
+
 
 class AudioType(Enum):
     DISCORD = AudioInfo(
@@ -30,31 +42,297 @@ class AudioType(Enum):
     )
 
 
-@dataclass
+def pcm_to_array(data: bytes | memoryview, info: AudioInfo) -> np.ndarray:
+    """View raw int16 PCM as a (samples, channels) array without copying."""
+    if info.sample_width != 2:
+        raise ValueError(f"Only 16-bit PCM is supported, got {info.sample_width * 8}-bit")
+    return np.frombuffer(data, dtype=np.int16).reshape(-1, info.channels)
+
+
+def remix_channels(samples: np.ndarray, channels: int) -> np.ndarray:
+    if samples.shape[1] == channels:
+        return samples
+    if channels == 1:
+        return (samples.sum(axis=1, dtype=np.int32, keepdims=True) // samples.shape[1]).astype(np.int16)
+    if samples.shape[1] == 1:
+        return np.repeat(samples, channels, axis=1)
+    raise ValueError(f"Can't remix {samples.shape[1]} channels into {channels}")
+
+
+def decimate(samples: np.ndarray, factor: int, channels: int) -> np.ndarray:
+    # box filter + decimation: every output sample is the mean of `factor` inputs.
+    # Downmixing to mono is folded into the same reduction.
+    if len(samples) % factor:
+        pad = factor - len(samples) % factor
+        samples = np.pad(samples, ((0, pad), (0, 0)), mode="edge")
+    if channels == 1:
+        out = samples.reshape(-1, factor * samples.shape[1]).sum(axis=1, dtype=np.int32)
+        out //= factor * samples.shape[1]
+        return out.astype(np.int16).reshape(-1, 1)
+    out = samples.reshape(-1, factor, samples.shape[1]).sum(axis=1, dtype=np.int32)
+    out //= factor
+    return remix_channels(out.astype(np.int16), channels)
+
+
+def interpolate(
+    samples: np.ndarray, factor: int, channels: int, following: np.ndarray | None = None
+) -> np.ndarray:
+    # linear interpolation between each sample and the next one;
+    # the last sample is held unless `following` provides its successor
+    samples = remix_channels(samples, 1) if channels == 1 else samples
+    if following is None:
+        following = samples[-1:]
+    current = samples.astype(np.int32)
+    diff = np.concatenate((current[1:], following.astype(np.int32))) - current
+    out = np.empty((len(samples), factor, channels), dtype=np.int16)
+    out[:, 0, :] = samples
+    for step in range(1, factor):
+        out[:, step, :] = current + diff * step // factor
+    return out.reshape(-1, channels)
+
+
+def interpolate_at(samples: np.ndarray, positions: np.ndarray, to_rate: int, channels: int) -> np.ndarray:
+    # linear interpolation in integer math; positions are in 1/to_rate
+    # input-sample units, and the last sample is held past the end
+    index, frac = np.divmod(positions, to_rate)
+    current = samples[index].astype(np.int64)
+    following = samples[np.minimum(index + 1, len(samples) - 1)].astype(np.int64)
+    out = current + (following - current) * frac[:, None] // to_rate
+    return remix_channels(out.astype(np.int16), channels)
+
+
+def resample(samples: np.ndarray, from_rate: int, to_rate: int, channels: int) -> np.ndarray:
+    if not len(samples):
+        return np.empty((0, channels), dtype=np.int16)
+    if from_rate == to_rate:
+        return remix_channels(samples, channels)
+    if from_rate % to_rate == 0:
+        return decimate(samples, from_rate // to_rate, channels)
+    if to_rate % from_rate == 0:
+        return interpolate(samples, to_rate // from_rate, channels)
+    # same arithmetic as Resampler._interp, so streaming matches converting whole
+    count = -(-len(samples) * to_rate // from_rate)
+    positions = np.arange(count, dtype=np.int64) * from_rate
+    return interpolate_at(samples, positions, to_rate, channels)
+
+
+def convert_pcm(data: bytes | memoryview, from_info: AudioInfo, to_info: AudioInfo) -> bytes:
+    """Convert raw PCM between formats in a single vectorized pass."""
+    if from_info == to_info:
+        return bytes(data)
+    samples = pcm_to_array(data, from_info)
+    return resample(samples, from_info.sample_rate, to_info.sample_rate, to_info.channels).tobytes()
+
+
+class Resampler:
+    """Streaming converter that carries its state across chunks, so feeding a
+    signal in arbitrary pieces gives the same output as converting it whole."""
+
+    def __init__(self, from_type: AudioType, to_type: AudioType):
+        self.from_type = from_type
+        self.to_type = to_type
+        self.from_info = from_type.value
+        self.to_info = to_type.value
+        if self.from_info.sample_width != 2 or self.to_info.sample_width != 2:
+            raise ValueError("Only 16-bit PCM is supported")
+        from_rate, to_rate = self.from_info.sample_rate, self.to_info.sample_rate
+        self.channels = self.to_info.channels
+        if from_rate == to_rate:
+            self._process = self._remix
+        elif from_rate % to_rate == 0:
+            self.factor = from_rate // to_rate
+            self._process = self._decimate
+        elif to_rate % from_rate == 0:
+            self.factor = to_rate // from_rate
+            self._process = self._interpolate
+        else:
+            self._process = self._interp
+        self.reset()
+
+    def reset(self):
+        # decimation keeps the incomplete group, interpolation keeps the last
+        # sample until its successor arrives
+        self._pending = np.empty((0, self.from_info.channels), dtype=np.int16)
+        self._offset = 0
+
+    def process(self, data: bytes | memoryview) -> bytes:
+        return self._process(pcm_to_array(data, self.from_info)).tobytes()
+
+    def convert(self, audio: "AudioData") -> "AudioData":
+        return AudioData(data=self.process(audio.data), atype=self.to_type, received=audio.received)
+
+    def flush(self) -> bytes:
+        """Emit whatever is held back and start over, e.g. at the end of a turn."""
+        pending = self._pending
+        if not len(pending):
+            out = b""
+        elif self._process == self._decimate:
+            out = decimate(pending, self.factor, self.channels).tobytes()
+        else:
+            # hold the last sample over its final interval
+            out = self._process(pending).tobytes()
+        self.reset()
+        return out
+
+    def _with_pending(self, samples: np.ndarray) -> np.ndarray:
+        if len(self._pending):
+            return np.concatenate((self._pending, samples))
+        return samples
+
+    def _remix(self, samples: np.ndarray) -> np.ndarray:
+        return remix_channels(samples, self.channels)
+
+    def _decimate(self, samples: np.ndarray) -> np.ndarray:
+        samples = self._with_pending(samples)
+        usable = len(samples) - len(samples) % self.factor
+        self._pending = samples[usable:].copy()
+        return decimate(samples[:usable], self.factor, self.channels)
+
+    def _interpolate(self, samples: np.ndarray) -> np.ndarray:
+        samples = self._with_pending(samples)
+        if len(samples) < 2:
+            self._pending = samples.copy()
+            return np.empty((0, self.channels), dtype=np.int16)
+        self._pending = samples[-1:].copy()
+        return interpolate(samples[:-1], self.factor, self.channels, following=samples[-1:])
+
+    def _interp(self, samples: np.ndarray) -> np.ndarray:
+        # positions are tracked as integers in 1/to_rate input-sample units,
+        # so chunk boundaries don't change the result
+        from_rate, to_rate = self.from_info.sample_rate, self.to_info.sample_rate
+        samples = self._with_pending(samples)
+        span = (len(samples) - 1) * to_rate
+        count = max(0, -(-(span - self._offset) // from_rate))
+        self._pending = samples[-1:].copy()
+        positions = self._offset + np.arange(count, dtype=np.int64) * from_rate
+        self._offset += count * from_rate - span
+        return interpolate_at(samples, positions, to_rate, self.channels)
+
+
+@dataclass(slots=True)
 class AudioData:
-    data: AudioSegment
+    data: bytes | memoryview
     atype: AudioType
+    # time.monotonic() stamps for latency tracing
+    received: float = 0.0
+    enqueued: float = 0.0
+
+    @property
+    def duration_ms(self) -> int:
+        return len(self.data) // self.atype.value.bytes_per_ms
 
     def convert(self, to_type: AudioType):
-        to_type_info = to_type.value
         return AudioData(
-            data=self.data.set_frame_rate(to_type_info.sample_rate)
-            .set_sample_width(to_type_info.sample_width)
-            .set_channels(to_type_info.channels),
+            data=convert_pcm(self.data, self.atype.value, to_type.value),
             atype=to_type,
         )
 
     @classmethod
-    def from_raw(cls, data: bytes, atype: AudioType):
-        return cls(
-            data=AudioSegment.from_raw(
-                BytesIO(data),
-                sample_width=atype.value.sample_width,
-                frame_rate=atype.value.sample_rate,
-                channels=atype.value.channels,
-            ),
-            atype=atype,
+    def from_raw(cls, data: bytes | memoryview, atype: AudioType):
+        return cls(data=data, atype=atype)
+
+    @classmethod
+    def from_segment(cls, segment: "AudioSegment", atype: AudioType):
+        info = atype.value
+        segment = (
+            segment.set_frame_rate(info.sample_rate)
+            .set_sample_width(info.sample_width)
+            .set_channels(info.channels)
+        )
+        return cls(data=segment.raw_data, atype=atype)
+
+    def to_segment(self) -> "AudioSegment":
+        # pydub only comes in at the edges, never per frame
+        from pydub import AudioSegment
+
+        info = self.atype.value
+        return AudioSegment.from_raw(
+            BytesIO(self.data),
+            sample_width=info.sample_width,
+            frame_rate=info.sample_rate,
+            channels=info.channels,
         )
 
     def to_google_segment(self):
-        return {"data": self.data.raw_data, "mime_type": "audio/pcm"}
+        return {
+            "data": bytes(self.data),
+            "mime_type": f"audio/pcm;rate={self.atype.value.sample_rate}",
+        }
+
+
+class PCMFrame:
+    """One speaker's packet on its way from a voice sink to its processing.
+
+    Frames come from a FramePool and go back to it once processed. `data`
+    is either the sink's own bytes or a view into the frame's buffer, which
+    decoders write into; either way it's only valid until release().
+    """
+
+    __slots__ = (
+        "owner", "atype", "user_id", "timestamp", "sequence", "received", "opus", "data", "_buffer", "_view", "_pool"
+    )
+
+    def __init__(self, pool: "FramePool"):
+        self._pool = pool
+        self.owner = pool.owner
+        self.atype = pool.atype
+        self.user_id = 0
+        self.timestamp = 0
+        self.sequence = 0
+        self.received = 0.0
+        # undecoded payload, when the frame comes from an opus-mode sink
+        self.opus: bytes | None = None
+        self.data: bytes | memoryview = b""
+        self._buffer: bytearray | None = None
+        self._view: memoryview | None = None
+
+    @property
+    def buffer(self) -> bytearray:
+        # only frames that get decoded into need one
+        if self._buffer is None:
+            self._buffer = bytearray(self._pool.frame_size)
+            self._view = memoryview(self._buffer)
+        return self._buffer
+
+    def set_length(self, size: int):
+        self.data = self._view[:size]
+
+    def release(self):
+        self.opus = None
+        self.data = b""
+        self._pool.put(self)
+
+
+class FramePool:
+    """Free list of PCMFrames, so a steady stream of packets reuses the same
+    few frames instead of allocating new ones. One thread gets, any thread
+    may put.
+
+    Under a backlog the free list runs dry and every packet gets a fresh
+    frame, which costs the collector more than a small tuple would; the
+    saving is at steady state, where frames come back before they're needed.
+    """
+
+    def __init__(self, atype: AudioType, frame_ms: int = 20, owner=None, max_free: int = 128):
+        self.atype = atype
+        self.frame_size = atype.value.bytes_per_ms * frame_ms
+        # handed to each frame, so a queue of frames needs no extra wrapping
+        self.owner = owner
+        # a backlog shouldn't leave thousands of frames parked here for good
+        self.max_free = max_free
+        self._free: list[PCMFrame] = []
+        self.allocated = 0
+
+    def __len__(self):
+        return len(self._free)
+
+    def get(self) -> PCMFrame:
+        try:
+            return self._free.pop()
+        except IndexError:
+            self.allocated += 1
+            return PCMFrame(self)
+
+    def put(self, frame: PCMFrame):
+        if len(self._free) < self.max_free:
+            self._free.append(frame)
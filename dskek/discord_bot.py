@@ -1,10 +1,10 @@
 import discord
 from discord.ext import commands
 import os
-from aiohttp_socks import ProxyConnector
-from dskek.env import DISCORD_BOT_TOKEN, PROXY
-from dskek.proxy_clients import get_aio_proxy_connector_checked
+from dskek.env import DISCORD_BOT_TOKEN
+from dskek.proxy_clients import connections
 import logging
+from typing import Awaitable, Callable
 
 
 intents = discord.Intents.default()
@@ -14,11 +14,31 @@ logger = logging.getLogger(__name__)
 
 
 class ProxiedBot(commands.Bot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.startup_callbacks: list[Callable[[], Awaitable]] = []
+        self.shutdown_callbacks: list[Callable[[], Awaitable]] = []
+
+    async def setup_hook(self):
+        # pools, caches and their files are opened here, never at import time
+        for callback in self.startup_callbacks:
+            await callback()
+
+    async def close(self):
+        for callback in self.shutdown_callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"Shutdown callback failed: {e}")
+        await super().close()
+        await connections.close()
+
     async def start(self, *args, **kwargs):
-        connector = get_aio_proxy_connector_checked(PROXY)
-        if connector:
-            self.http.connector = connector
-            logger.info(f"Using proxy: {PROXY}")
+        # REST calls (and the gateway websocket) share the "discord" pool
+        self.http.connector = connections.connector("discord")
+        self.http.http_trace = connections.trace("discord")
+        if proxy := connections.config("discord").proxy:
+            logger.info(f"Using proxy: {proxy}")
         logger.info("Starting bot...")
         await super().start(*args, **kwargs)
 
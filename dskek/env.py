@@ -8,8 +8,38 @@ DISCORD_BOT_TOKEN = os.environ.get("DISCORD_BOT_TOKEN")
 PROXY = os.environ.get("PROXY") or os.environ.get("HTTP_PROXY") or os.environ.get("HTTPS_PROXY")
 YT_PROXY = os.environ.get("YT_PROXY")
 FFMPEG_PROXY = os.environ.get("FFMPEG_PROXY")
-
-if PROXY:
-    os.environ["wss_proxy"] = PROXY
-    os.environ["ws_proxy"] = PROXY
-
+WAKE_WORD = os.environ.get("WAKE_WORD", "гриш")
+VOSK_MODEL_PATH = os.environ.get("VOSK_MODEL_PATH")
+MAX_GEMINI_SESSIONS = int(os.environ.get("MAX_GEMINI_SESSIONS", 8))
+SESSION_IDLE_TIMEOUT = float(os.environ.get("SESSION_IDLE_TIMEOUT", 600))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+# Live sessions kept connected ahead of !join; 0 disables the pool
+LIVE_POOL_SIZE = int(os.environ.get("LIVE_POOL_SIZE", 1))
+LIVE_POOL_MAX_IDLE = float(os.environ.get("LIVE_POOL_MAX_IDLE", 300))
+# yt-dlp extraction cache; an empty path keeps it in memory only
+YT_CACHE_PATH = os.environ.get("YT_CACHE_PATH", "ytdl_cache.sqlite3")
+YT_CACHE_SIZE = int(os.environ.get("YT_CACHE_SIZE", 512))
+# tracks resolved (and their ffmpeg started) ahead of the one playing
+MUSIC_PREFETCH_DEPTH = int(os.environ.get("MUSIC_PREFETCH_DEPTH", 1))
+MUSIC_MAX_EXTRACTIONS = int(os.environ.get("MUSIC_MAX_EXTRACTIONS", 2))
+MUSIC_VOLUME = float(os.environ.get("MUSIC_VOLUME", 0.5))
+# hand ffmpeg's opus packets straight to discord instead of decoding to PCM in python
+MUSIC_OPUS_PASSTHROUGH = os.environ.get("MUSIC_OPUS_PASSTHROUGH", "1") != "0"
+# tracks played MEDIA_CACHE_MIN_PLAYS times are kept on disk; an empty dir disables it
+MEDIA_CACHE_DIR = os.environ.get("MEDIA_CACHE_DIR", "media_cache")
+MEDIA_CACHE_MAX_MB = int(os.environ.get("MEDIA_CACHE_MAX_MB", 2048))
+MEDIA_CACHE_MIN_PLAYS = int(os.environ.get("MEDIA_CACHE_MIN_PLAYS", 2))
+# yt-dlp extraction workers, as threads or (YTDL_WORKER_PROCESSES=1) processes
+YTDL_WORKERS = int(os.environ.get("YTDL_WORKERS", 2))
+YTDL_WORKER_PROCESSES = os.environ.get("YTDL_WORKER_PROCESSES", "0") == "1"
+# threads doing VAD, mixing and resampling of received voice; 0 = one per core
+RECEIVE_WORKERS = int(os.environ.get("RECEIVE_WORKERS", 0))
+# take raw Opus from voice_recv and decode it to 16 kHz mono on those workers
+VOICE_RECV_OPUS = os.environ.get("VOICE_RECV_OPUS", "1") != "0"
+# how audio crosses between the voice threads and the event loop: "queue" or "ring"
+STREAM_TRANSPORT = os.environ.get("STREAM_TRANSPORT", "queue")
+# shared HTTP connection pools (see proxy_clients); a limit of 0 means none
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", 100))
+HTTP_KEEPALIVE = float(os.environ.get("HTTP_KEEPALIVE", 60))
+DNS_CACHE_TTL = int(os.environ.get("DNS_CACHE_TTL", 300))
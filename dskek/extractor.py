@@ -0,0 +1,131 @@
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from dskek._ytdl_worker import ExtractionError, extract, init_worker
+from dskek.metrics import Histogram, since_ms
+import multiprocessing
+import asyncio
+import logging
+import time
+
+
+logger = logging.getLogger("discord")
+
+@dataclass
+class ExtractionJob:
+    url: str
+    download: bool
+    future: asyncio.Future
+    directory: str | None = None
+    queued: float = field(default_factory=time.monotonic)
+
+
+class ExtractionPool:
+    """Runs yt-dlp extractions on a private pool of workers.
+
+    Jobs wait in one queue per guild and are dispatched round-robin, so a
+    burst of !play in one guild can't starve the others (nor the default
+    executor). Jobs whose caller gave up before a worker picked them up are
+    skipped; running ones finish but their result is dropped.
+    """
+
+    def __init__(self, options: dict, workers: int = 2, processes: bool = False, download_workers: int = 1):
+        self.workers = workers
+        self._executor = self._make_executor(options, workers, processes, "ytdl")
+        # downloads can take hours, so they get their own lane and never hold an extraction worker
+        self._download_executor = self._make_executor(options, download_workers, processes, "ytdl-download")
+        self._queues: OrderedDict[int | None, deque[ExtractionJob]] = OrderedDict()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.downloading = 0
+        self.wait = Histogram("extraction_wait_ms", "Time an extraction waits for a worker")
+
+    @staticmethod
+    def _make_executor(options: dict, workers: int, processes: bool, name: str) -> Executor:
+        if processes:
+            # spawned workers import dskek._ytdl_worker only, never the bot itself
+            return ProcessPoolExecutor(
+                workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(options,),
+            )
+        return ThreadPoolExecutor(workers, thread_name_prefix=name, initializer=init_worker, initargs=(options,))
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def extract(
+        self, url: str, *, guild_id: int | None = None, download: bool = False, directory: str | None = None
+    ) -> dict:
+        job = ExtractionJob(url, download, asyncio.get_running_loop().create_future(), directory)
+        self._queues.setdefault(guild_id, deque()).append(job)
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+    async def download(self, url: str, directory: str) -> str:
+        """Download the best audio into directory, returning the file's path.
+
+        Runs on the download lane, not the guild queues; callers limit how
+        many run at once."""
+        self.downloading += 1
+        try:
+            future = self._download_executor.submit(extract, url, True, directory)
+            data = await asyncio.wrap_future(future)
+        finally:
+            self.downloading -= 1
+        return data['filepath']
+
+    def _dispatch(self):
+        while self.running < self.workers and self._queues:
+            guild_id, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            if queue:
+                # this guild goes to the back of the line
+                self._queues.move_to_end(guild_id)
+            else:
+                del self._queues[guild_id]
+            if job.future.done():
+                continue
+            self.wait.observe(since_ms(job.queued))
+            self.running += 1
+            future = asyncio.wrap_future(self._executor.submit(extract, job.url, job.download, job.directory))
+            future.add_done_callback(lambda done, job=job: self._finished(job, done))
+
+    def _finished(self, job: ExtractionJob, done: asyncio.Future):
+        self.running -= 1
+        if done.cancelled():
+            job.future.cancel()
+        elif (error := done.exception()) is not None:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+        else:
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(done.result())
+        self._dispatch()
+
+    async def shutdown(self):
+        for queue in self._queues.values():
+            for job in queue:
+                job.future.cancel()
+        self._queues.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._download_executor.shutdown(wait=False, cancel_futures=True)
+
+    def summary(self) -> str:
+        per_guild = ", ".join(f"{guild_id}={len(queue)}" for guild_id, queue in self._queues.items())
+        return (
+            f"workers={self.workers} running={self.running} queued={self.queued}"
+            f"{f' ({per_guild})' if per_guild else ''} completed={self.completed} "
+            f"failed={self.failed} cancelled={self.cancelled} downloading={self.downloading} "
+            f"wait p50<={self.wait.quantile(0.5)} p99<={self.wait.quantile(0.99)}"
+        )
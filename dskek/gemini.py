@@ -23,10 +23,15 @@ import argparse
 
 from google import genai
 from google.genai import types
-from dskek.models import QueueData, AudioData, AudioType
+from dskek.models import QueueData, SpeechEvent
 from dskek.converters import AudioData, AudioType
 from dskek.channels import Stream
-from pydub import AudioSegment
+from dskek.metrics import since_ms
+from dskek.env import PROXY
+from contextlib import AbstractAsyncContextManager
+from collections import deque
+from typing import Callable
+import random
 import time
 import logging
 
@@ -41,8 +46,27 @@ logger = logging.getLogger("discord")
 
 MODEL = "models/gemini-2.5-flash-native-audio-preview-12-2025"
 
+# upstream audio is coalesced into messages of about this many milliseconds
+SEND_BATCH_MS = 100
+# ...but a frame never waits longer than this for the rest of its batch
+SEND_MAX_WAIT_MS = 100
+# reconnect delays grow from BASE to MAX, each randomized by up to half
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+# a session that lived this long resets the backoff
+RECONNECT_STABLE_AFTER = 60
+# most recent input kept while the connection is down, replayed on reconnect
+REPLAY_BUFFER_MS = 3_000
+# what upstream audio may arrive as (the ring transport hands out memoryviews)
+PCM_TYPES = (bytes, bytearray, memoryview)
+
+_http_options = {"api_version": "v1beta"}
+if PROXY:
+    # genai hands this on to the Live websocket connect; it keeps no connection pool
+    _http_options["async_client_args"] = {"proxy": PROXY}
+
 client = genai.Client(
-    http_options={"api_version": "v1beta"},
+    http_options=_http_options,
     api_key=os.environ.get("GEMINI_API_KEY"),
 )
 
@@ -66,6 +90,8 @@ CONFIG = types.LiveConnectConfig(
         sliding_window=types.SlidingWindow(target_tokens=12800),
     ),
     tools=tools,
+    # the server sends resumption handles so a dropped session can be picked up
+    session_resumption=types.SessionResumptionConfig(),
     system_instruction=types.Content(
         parts=[
             types.Part.from_text(
@@ -77,8 +103,47 @@ CONFIG = types.LiveConnectConfig(
 )
 
 
+def connect_live(handle: str | None = None):
+    config = CONFIG
+    if handle:
+        config = CONFIG.model_copy(
+            update={"session_resumption": types.SessionResumptionConfig(handle=handle)}
+        )
+    return client.aio.live.connect(model=MODEL, config=config)
+
+
+class SessionExpiring(Exception):
+    pass
+
+
 class AudioLoop:
-    def __init__(self, stream: Stream):
+    def __init__(
+        self,
+        stream: Stream,
+        batch_ms: int = SEND_BATCH_MS,
+        max_wait_ms: int = SEND_MAX_WAIT_MS,
+        connect: Callable[[], AbstractAsyncContextManager] = connect_live,
+        resume: Callable[[str], AbstractAsyncContextManager] = connect_live,
+        replay_ms: int = REPLAY_BUFFER_MS,
+    ):
+        self.stream = stream
+        self.connect = connect
+        self.resume = resume
+        self.resumption_handle: str | None = None
+        # upstream input that didn't make it to a live session: 16 kHz pcm,
+        # END markers and text, in order
+        self._replay: deque[bytes | memoryview | SpeechEvent | str] = deque()
+        self._replay_ms = 0
+        self.replay_limit_ms = replay_ms
+        self.reconnects = 0
+        self.replay_dropped_ms = 0
+        # a response is being received; after a barge-in the rest of it is dropped
+        self._in_turn = False
+        self._discarding = False
+        self.batch_ms = batch_ms
+        self.max_wait_ms = max_wait_ms
+        self._held: QueueData | None = None
+        # upstream audio arrives already in Gemini's format (VoiceBot._send_mixed)
         self.in_queue = stream.audio_in_queue
         self.out_queue = stream.audio_out_queue
 
@@ -87,6 +152,15 @@ class AudioLoop:
         self.send_text_task = None
         self.receive_audio_task = None
         self.play_audio_task = None
+        stream.metrics.counters.update(
+            gemini_reconnects=lambda: self.reconnects,
+            replay_dropped_ms=lambda: self.replay_dropped_ms,
+        )
+
+    @property
+    def responding(self) -> bool:
+        """A response is coming in and will be played."""
+        return self._in_turn and not (self._discarding or self.stream.cut_off)
 
     async def send_text(self, text: str):
         logger.info(f"Sending text: {text}")
@@ -105,18 +179,97 @@ class AudioLoop:
         frame = {"mime_type": mime_type, "data": base64.b64encode(image_bytes).decode()}
         await self.in_queue.put(frame)
 
+    async def _next_message(self, timeout: float | None = None) -> QueueData | None:
+        if self._held is not None:
+            msg, self._held = self._held, None
+            return msg
+        if timeout is None:
+            return await self.in_queue.get()
+        try:
+            return self.in_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        if timeout <= 0:
+            return None
+        try:
+            return await asyncio.wait_for(self.in_queue.get(), timeout)
+        except TimeoutError:
+            return None
+
+    async def _collect_batch(self, first: AudioData) -> bytes:
+        # drain whatever is queued, wait at most max_wait for the rest of the batch
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait_ms / 1000
+        frames = [first.data]
+        millis = first.duration_ms
+        queue_wait = self.stream.metrics.queue_wait
+        queue_wait.observe(since_ms(first.enqueued))
+        try:
+            while millis < self.batch_ms:
+                msg = await self._next_message(deadline - loop.time())
+                if msg is None:
+                    break
+                if not isinstance(msg, AudioData):
+                    self._held = msg
+                    break
+                queue_wait.observe(since_ms(msg.enqueued))
+                frames.append(msg.data)
+                millis += msg.duration_ms
+        except asyncio.CancelledError:
+            # the session went away mid-batch: what was dequeued goes to the next one
+            self._stash(b"".join(frames))
+            raise
+        return b"".join(frames)
+
+    async def _send_audio(self, pcm: bytes):
+        if pcm:
+            started = time.monotonic()
+            await self.session.send_realtime_input(
+                audio=AudioData(pcm, AudioType.GEMINI_SEND).to_google_segment()
+            )
+            self.stream.metrics.send.observe(since_ms(started))
+
     async def send_realtime(self):
         logger.info("Gemini starting send_realtime")
         millis = 0
+        messages = 0
         t = time.time()
         while True:
-            msg: AudioData = await self.in_queue.get()
-            millis += len(msg.data)
-            msg_converted = msg.convert(AudioType.GEMINI_SEND).to_google_segment()
-            await self.session.send(input=msg_converted)
+            msg: QueueData = await self._next_message()
+            if msg is SpeechEvent.START:
+                continue
+            if msg is SpeechEvent.END:
+                try:
+                    await self.session.send_realtime_input(audio_stream_end=True)
+                except (Exception, asyncio.CancelledError):
+                    self._stash(SpeechEvent.END)
+                    raise
+                continue
+            if isinstance(msg, str):
+                try:
+                    await self.session.send_realtime_input(text=msg)
+                except (Exception, asyncio.CancelledError):
+                    self._stash(msg)
+                    raise
+                continue
+            if isinstance(msg, dict):
+                await self.session.send(input=msg)
+                continue
+            # one websocket message per batch
+            pcm = await self._collect_batch(msg)
+            try:
+                await self._send_audio(pcm)
+            except (Exception, asyncio.CancelledError):
+                self._stash(pcm)
+                raise
+            if msg.received:
+                self.stream.metrics.ingest.observe(since_ms(msg.received))
+            millis += len(pcm) // AudioType.GEMINI_SEND.value.bytes_per_ms
+            messages += 1
             if time.time() - t > 10:
-                logger.info(f"Gemini received {millis=} of audio over 10s")
+                logger.info(f"Gemini received {millis=} of audio in {messages} messages over 10s")
                 millis = 0
+                messages = 0
                 t = time.time()
 
     async def receive_audio(self):
@@ -125,43 +278,157 @@ class AudioLoop:
         while True:
             turn = self.session.receive()
             async for response in turn:
+                content = response.server_content
+                if content and content.interrupted:
+                    self._barge_in()
+                if self.stream.take_cut_off() and self._in_turn:
+                    # talked over (VoiceBot._push): the player already dropped
+                    # what was queued, don't let the rest of this answer in either
+                    self._discarding = True
+                    self.stream.from_gemini.reset()
                 if data := response.data:
-                    # logger.info(f"Received {len(data)} bytes of audio from gemini")
-                    self.out_queue.put_nowait(
-                        AudioData.from_raw(data=data, atype=AudioType.GEMINI_RECEIVE)
-                    )
+                    if self._discarding:
+                        self.stream.discard(len(data) // AudioType.GEMINI_RECEIVE.value.bytes_per_ms)
+                    else:
+                        self._in_turn = True
+                        await self._queue_output(data)
+                if content and content.turn_complete:
+                    self._in_turn = False
+                    self._discarding = False
+                if data:
                     continue
                 if text := response.text:
                     logger.info(f"Received text from gemini: {text}")
+                if (update := response.session_resumption_update) and update.resumable:
+                    if update.new_handle:
+                        self.resumption_handle = update.new_handle
+                if go_away := response.go_away:
+                    # reconnect on our terms while the handle is still valid
+                    raise SessionExpiring(f"server is closing the session in {go_away.time_left}")
 
-            # # If you interrupt the model, it sends a turn_complete.
-            # # For interruptions to work, we need to stop playback.
-            # # So empty out the audio queue because it may have loaded
-            # # much more audio than has played yet.
-            # while not self.out_queue.empty():
-            #     self.out_queue.get_nowait()
+    async def _queue_output(self, data: bytes):
+        # logger.info(f"Received {len(data)} bytes of audio from gemini")
+        metrics = self.stream.metrics
+        metrics.first_audio_received()
+        # convert on arrival so the player thread only copies bytes
+        started = time.monotonic()
+        converted = self.stream.from_gemini.convert(
+            AudioData.from_raw(data=data, atype=AudioType.GEMINI_RECEIVE)
+        )
+        metrics.conversion.observe(since_ms(started))
+        if self.stream.cut_off:
+            # interrupted while converting: leave it to the next message
+            self.stream.discard(converted.duration_ms)
+            return
+        await self.stream.put_out(converted)
 
-    async def run(self):
-        try:
-            async with (
-                client.aio.live.connect(model=MODEL, config=CONFIG) as session,
-                asyncio.TaskGroup() as tg,
-            ):
-                self.session = session
+    def _barge_in(self):
+        logger.info("Gemini response interrupted")
+        self._discarding = True
+        self.stream.from_gemini.reset()
+        self.stream.interrupt()
 
-                # send_text_task = tg.create_task(self.send_text())
-                t1 = tg.create_task(self.send_realtime())
-                t2 = tg.create_task(self.receive_audio())
+    def _stash(self, item: bytes | memoryview | SpeechEvent | str):
+        if isinstance(item, PCM_TYPES):
+            if not item:
+                return
+            bytes_per_ms = AudioType.GEMINI_SEND.value.bytes_per_ms
+            # the ring hands over everything buffered at once; keep its newest part
+            excess = len(item) - self.replay_limit_ms * bytes_per_ms
+            if excess > 0:
+                item = item[excess:]
+                self.replay_dropped_ms += excess // bytes_per_ms
+            self._replay_ms += len(item) // bytes_per_ms
+        self._replay.append(item)
+        # only audio is dropped, the oldest first; END markers and text stay
+        while self._replay_ms > self.replay_limit_ms:
+            for index, old in enumerate(self._replay):
+                if isinstance(old, PCM_TYPES):
+                    del self._replay[index]
+                    millis = len(old) // AudioType.GEMINI_SEND.value.bytes_per_ms
+                    self._replay_ms -= millis
+                    self.replay_dropped_ms += millis
+                    break
 
-                await asyncio.gather(t1, t2)
-                # await send_text_task
-                # raise asyncio.CancelledError("User requested exit")
+    async def _buffer_input(self, seconds: float):
+        """Keep taking input while disconnected so the newest audio survives."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        while (msg := await self._next_message(deadline - loop.time())) is not None:
+            if isinstance(msg, AudioData):
+                self._stash(msg.data)
+            elif msg is SpeechEvent.END or isinstance(msg, str):
+                self._stash(msg)
 
-        except asyncio.CancelledError:
-            logger.info("User requested exit")
-            pass
-        except ExceptionGroup as EG:
-            logger.error(
-                f"An error occurred in the Gemini stream: {EG}\n{traceback.format_exc()}"
+    async def _send_replay(self):
+        if self._replay:
+            logger.info(f"Replaying {self._replay_ms} ms of buffered input to Gemini")
+        while self._replay:
+            item = self._replay[0]
+            if item is SpeechEvent.END:
+                await self.session.send_realtime_input(audio_stream_end=True)
+            elif isinstance(item, str):
+                await self.session.send_realtime_input(text=item)
+            else:
+                await self._send_audio(item)
+                self._replay_ms -= len(item) // AudioType.GEMINI_SEND.value.bytes_per_ms
+            self._replay.popleft()
+
+    def _open_session(self) -> AbstractAsyncContextManager:
+        if self.resumption_handle:
+            return self.resume(self.resumption_handle)
+        return self.connect()
+
+    async def _run_session(self):
+        async with (
+            self._open_session() as session,
+            asyncio.TaskGroup() as tg,
+        ):
+            self.session = session
+            await self._send_replay()
+
+            # send_text_task = tg.create_task(self.send_text())
+            t1 = tg.create_task(self.send_realtime())
+            t2 = tg.create_task(self.receive_audio())
+
+            await asyncio.gather(t1, t2)
+            # await send_text_task
+            # raise asyncio.CancelledError("User requested exit")
+
+    async def run(self):
+        failures = 0
+        while True:
+            started = time.monotonic()
+            self.session = None
+            try:
+                await self._run_session()
+            except asyncio.CancelledError:
+                logger.info("User requested exit")
+                raise
+            except ExceptionGroup as EG:
+                logger.error(
+                    f"An error occurred in the Gemini stream: {EG}\n{traceback.format_exc()}"
+                )
+            except Exception as e:
+                logger.error(f"Gemini connection failed: {e}")
+
+            if self.session is None and self.resumption_handle:
+                # the handle may have expired: start a fresh session next time
+                logger.warning("Couldn't resume the Gemini session, starting a new one")
+                self.resumption_handle = None
+            self.session = None
+            if time.monotonic() - started > RECONNECT_STABLE_AFTER:
+                failures = 0
+            delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2**failures)
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            failures += 1
+            self.reconnects += 1
+            # the next session starts a new turn: drop half-converted output
+            self.stream.from_gemini.reset()
+            self._in_turn = False
+            self._discarding = False
+            logger.info(
+                f"Reconnecting to Gemini in {delay:.1f}s "
+                f"({'resuming' if self.resumption_handle else 'new session'})"
             )
-            # traceback.print_exception(EG)
+            await self._buffer_input(delay)
@@ -0,0 +1,188 @@
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from dataclasses import dataclass, field
+from collections import deque
+from typing import Any, AsyncIterator, Callable
+import asyncio
+import logging
+import time
+
+
+logger = logging.getLogger("discord")
+
+# sessions older than this are closed and replaced instead of handed out
+POOL_MAX_IDLE = 300
+# idle sessions are pinged before use, fresh ones are trusted as-is
+POOL_PING_AFTER = 15
+POOL_PING_TIMEOUT = 2
+POOL_CHECK_INTERVAL = 10
+# with no join or reconnect for this long, the warm sessions are closed
+POOL_IDLE_AFTER = 1_800
+POOL_RETRY_DELAYS = (1, 2, 5, 10, 30, 60)
+
+
+@dataclass
+class PooledSession:
+    session: Any
+    created: float = field(default_factory=time.monotonic)
+    # set to let the holder task leave the connect() context and close the socket
+    released: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.created
+
+
+class LiveSessionPool:
+    """Keeps a few Live sessions connected ahead of time so a join doesn't
+    wait for the TLS/websocket/setup handshake.
+
+    Every pooled session is owned by a holder task that stays inside the
+    connect() context until the session is released, so the connection is
+    opened and closed by the same task whichever guild ends up using it.
+
+    The pool warms up on first use and empties again once it hasn't been
+    used for `idle_after` seconds. Warm sessions count against the same
+    limit as the ones in use: `spare()` says how many more may be open.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], AbstractAsyncContextManager],
+        size: int,
+        max_idle: float = POOL_MAX_IDLE,
+        spare: Callable[[], int] | None = None,
+        idle_after: float = POOL_IDLE_AFTER,
+    ):
+        self._connect = connect
+        self.size = size
+        self.max_idle = max_idle
+        self._spare = spare
+        self.idle_after = idle_after
+        self._last_used = time.monotonic()
+        self._ready: deque[PooledSession] = deque()
+        self._connecting = 0
+        self._failures = 0
+        self._holders: set[asyncio.Task] = set()
+        self._maintainer: asyncio.Task | None = None
+        self._wake = asyncio.Event()
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    def start(self):
+        if self.size > 0 and (self._maintainer is None or self._maintainer.done()):
+            self._maintainer = asyncio.create_task(self._maintain(), name="live-session-pool")
+
+    async def close(self):
+        if self._maintainer:
+            self._maintainer.cancel()
+            self._maintainer = None
+        while self._ready:
+            self._ready.popleft().released.set()
+        for task in list(self._holders):
+            task.cancel()
+        await asyncio.gather(*self._holders, return_exceptions=True)
+
+    @asynccontextmanager
+    async def connect(self) -> AsyncIterator[Any]:
+        self._last_used = time.monotonic()
+        # the first join warms the pool for the next one
+        self.start()
+        entry = await self._acquire()
+        if entry is None:
+            self.misses += 1
+            async with self._connect() as session:
+                yield session
+            return
+        self.hits += 1
+        try:
+            yield entry.session
+        finally:
+            entry.released.set()
+
+    async def _acquire(self) -> PooledSession | None:
+        while self._ready:
+            entry = self._ready.popleft()
+            self._wake.set()
+            if entry.age <= self.max_idle and await self._healthy(entry):
+                return entry
+            self.recycled += 1
+            entry.released.set()
+        return None
+
+    async def _healthy(self, entry: PooledSession) -> bool:
+        ws = getattr(entry.session, "_ws", None)
+        if ws is None:
+            return True
+        if getattr(ws, "close_code", None) is not None:
+            return False
+        if entry.age < POOL_PING_AFTER:
+            return True
+        try:
+            pong = await ws.ping()
+            await asyncio.wait_for(pong, POOL_PING_TIMEOUT)
+            return True
+        except Exception as e:
+            logger.warning(f"Pooled Live session failed health check: {e}")
+            return False
+
+    def _target(self) -> int:
+        if time.monotonic() - self._last_used > self.idle_after:
+            return 0
+        if self._spare is None:
+            return self.size
+        return max(0, min(self.size, self._spare()))
+
+    async def _maintain(self):
+        while True:
+            target = self._target()
+            while self._ready and self._ready[0].age > self.max_idle:
+                self.recycled += 1
+                self._ready.popleft().released.set()
+            while self._ready and len(self._ready) + self._connecting > target:
+                self._ready.popleft().released.set()
+            if target == 0 and not self._connecting:
+                # idle or no room: stop here instead of reconnecting forever
+                logger.info("Live session pool is empty until the next join")
+                self._maintainer = None
+                return
+            for _ in range(target - len(self._ready) - self._connecting):
+                self._connecting += 1
+                task = asyncio.create_task(self._hold())
+                self._holders.add(task)
+                task.add_done_callback(self._holders.discard)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), POOL_CHECK_INTERVAL)
+            except TimeoutError:
+                pass
+
+    async def _hold(self):
+        entry = None
+        try:
+            async with self._connect() as session:
+                entry = PooledSession(session)
+                self._ready.append(entry)
+                self._connecting -= 1
+                self._failures = 0
+                await entry.released.wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if entry is not None:
+                # the session died while in use or while waiting in the pool
+                logger.info(f"Pooled Live session closed: {e}")
+                return
+            delay = POOL_RETRY_DELAYS[min(self._failures, len(POOL_RETRY_DELAYS) - 1)]
+            self._failures += 1
+            logger.error(f"Failed to pre-connect a Live session, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+        finally:
+            if entry is None:
+                self._connecting -= 1
+            elif entry in self._ready:
+                self._ready.remove(entry)
+            self._wake.set()
@@ -0,0 +1,259 @@
+from typing import Awaitable, Callable
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+
+
+logger = logging.getLogger("discord")
+
+# live streams and very long videos are never downloaded
+MAX_DURATION = 3 * 3_600
+TRANSCODE_BITRATE = 128
+DOWNLOAD_PREFIX = "download-"
+# one download at a time keeps the proxy usable for streaming
+DOWNLOAD_SLOTS = 1
+# play counts of tracks that never got cached are forgotten after this long
+PLAY_HISTORY_TTL = 30 * 86_400
+PRUNE_INTERVAL = 3_600
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaCache:
+    """Local Ogg/Opus copies of tracks that get played repeatedly.
+
+    A play is counted when a track starts; once a track reaches `min_plays`
+    it is downloaded and remuxed (or transcoded) in the background. Files
+    are evicted least-recently-used first to stay under `max_bytes`, and
+    each file's size and sha256 are checked before it's first served.
+    The index is only read and written from worker threads.
+    """
+
+    def __init__(
+        self,
+        directory: str | None,
+        max_bytes: int,
+        min_plays: int,
+        download: Callable[[str, str], Awaitable[str]],
+    ):
+        # download(url, directory) fetches the best audio into directory, returning its path
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.download = download
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self._downloads: dict[str, asyncio.Task] = {}
+        self._counting: set[asyncio.Task] = set()
+        self._verified: set[str] = set()
+        self._download_slots = asyncio.Semaphore(DOWNLOAD_SLOTS)
+        self._pruned = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.downloaded = 0
+        self.evicted = 0
+        self.failed = 0
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+                self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+                self._db.executescript(
+                    """
+                    PRAGMA journal_mode=WAL;
+                    CREATE TABLE IF NOT EXISTS media (
+                        key TEXT PRIMARY KEY,
+                        plays INTEGER NOT NULL DEFAULT 0,
+                        path TEXT,
+                        size INTEGER,
+                        sha256 TEXT,
+                        last_used REAL NOT NULL
+                    );
+                    """
+                )
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Media cache at {directory} is unusable, streaming everything: {e}")
+                self._db = None
+            else:
+                self._remove_leftovers()
+                self._prune(time.time())
+
+    def _remove_leftovers(self):
+        # interrupted downloads and files the index no longer knows about
+        known = {os.path.basename(path) for (path,) in self._execute("SELECT path FROM media WHERE path IS NOT NULL")}
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and entry.name.startswith(DOWNLOAD_PREFIX):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            elif entry.is_file() and entry.name.endswith(".ogg") and entry.name not in known:
+                os.remove(entry.path)
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    @staticmethod
+    def key(data: dict) -> str | None:
+        if not data.get("id"):
+            return None
+        return f"{data.get('extractor_key') or data.get('extractor') or 'generic'}-{data['id']}"
+
+    def _execute(self, sql: str, params=()) -> list:
+        with self._db_lock:
+            rows = self._db.execute(sql, params).fetchall()
+            self._db.commit()
+            return rows
+
+    async def lookup(self, data: dict) -> str | None:
+        """Local file for this track if it's cached."""
+        key = self.key(data)
+        if not self.enabled or key is None:
+            return None
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT path, size, sha256 FROM media WHERE key = ? AND path IS NOT NULL", (key,)
+        )
+        if rows and await self._intact(key, *rows[0]):
+            self.hits += 1
+            return rows[0][0]
+        self.misses += 1
+        return None
+
+    def played(self, data: dict):
+        """Count a play of a track that just started; may start caching it."""
+        key = self.key(data)
+        if not self.enabled or key is None:
+            return
+        task = asyncio.create_task(self._count(key, data), name=f"count-{key}")
+        self._counting.add(task)
+        task.add_done_callback(self._counting.discard)
+
+    async def _count(self, key: str, data: dict):
+        try:
+            plays, path = await asyncio.to_thread(self._record_play, key, time.time())
+        except sqlite3.Error as e:
+            logger.warning(f"Couldn't count a play of {key}: {e}")
+            return
+        if path is None and plays >= self.min_plays and self._worth_caching(data):
+            self._start_download(key, data)
+
+    def _record_play(self, key: str, now: float) -> tuple[int, str | None]:
+        (plays, path), = self._execute(
+            "INSERT INTO media (key, plays, last_used) VALUES (?, 1, ?) "
+            "ON CONFLICT(key) DO UPDATE SET plays = plays + 1, last_used = excluded.last_used "
+            "RETURNING plays, path",
+            (key, now),
+        )
+        if now - self._pruned >= PRUNE_INTERVAL:
+            self._prune(now)
+        return plays, path
+
+    def _prune(self, now: float):
+        # tracks that were played a few times and never again
+        self._pruned = now
+        self._execute("DELETE FROM media WHERE path IS NULL AND last_used < ?", (now - PLAY_HISTORY_TTL,))
+
+    async def _intact(self, key: str, path: str, size: int, sha256: str) -> bool:
+        try:
+            intact = os.path.getsize(path) == size
+            if intact and key not in self._verified:
+                intact = await asyncio.to_thread(file_digest, path) == sha256
+        except OSError:
+            intact = False
+        if intact:
+            self._verified.add(key)
+            return True
+        logger.warning(f"Cached media for {key} is missing or corrupt, dropping it")
+        self._verified.discard(key)
+        await asyncio.to_thread(self._forget, key, path)
+        return False
+
+    def _worth_caching(self, data: dict) -> bool:
+        if data.get("is_live") or not data.get("webpage_url"):
+            return False
+        return (data.get("duration") or 0) <= MAX_DURATION
+
+    def _start_download(self, key: str, data: dict):
+        if key in self._downloads:
+            return
+        task = self._downloads[key] = asyncio.create_task(self._fetch(key, data), name=f"cache-{key}")
+        task.add_done_callback(lambda _: self._downloads.pop(key, None))
+
+    async def _fetch(self, key: str, data: dict):
+        async with self._download_slots:
+            try:
+                with tempfile.TemporaryDirectory(prefix=DOWNLOAD_PREFIX, dir=self.directory) as tmp:
+                    downloaded = await self.download(data["webpage_url"], tmp)
+                    path, size, sha256 = await asyncio.to_thread(self._convert, key, data, downloaded, tmp)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Failed to cache {key}: {e}")
+                return
+        evicted = await asyncio.to_thread(self._add, key, path, size, sha256)
+        self._verified.add(key)
+        self._verified.difference_update(evicted)
+        self.downloaded += 1
+        self.evicted += len(evicted)
+        logger.info(f"Cached {key} ({size // 1024} KiB)")
+
+    def _add(self, key: str, path: str, size: int, sha256: str) -> list[str]:
+        self._execute("UPDATE media SET path = ?, size = ?, sha256 = ? WHERE key = ?", (path, size, sha256, key))
+        return self._evict()
+
+    def _convert(self, key: str, data: dict, downloaded: str, tmp: str) -> tuple[str, int, str]:
+        final = os.path.join(self.directory, f"{key}.ogg")
+        converted = os.path.join(tmp, "converted.ogg")
+        # opus just moves from webm into ogg; anything else is encoded once
+        codec = ["-c:a", "copy"] if data.get("acodec") == "opus" else ["-c:a", "libopus", "-b:a", f"{TRANSCODE_BITRATE}k"]
+        subprocess.run(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", downloaded, "-vn", "-map_metadata", "-1", *codec, converted],
+            check=True,
+            capture_output=True,
+        )
+        sha256 = file_digest(converted)
+        size = os.path.getsize(converted)
+        os.replace(converted, final)
+        return final, size, sha256
+
+    def _forget(self, key: str, path: str | None):
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._execute("UPDATE media SET path = NULL, size = NULL, sha256 = NULL WHERE key = ?", (key,))
+
+    def _evict(self) -> list[str]:
+        rows = self._execute("SELECT key, path, size FROM media WHERE path IS NOT NULL ORDER BY last_used DESC")
+        total = 0
+        evicted = []
+        for key, path, size in rows:
+            if total + size > self.max_bytes:
+                self._forget(key, path)
+                evicted.append(key)
+            else:
+                # older files may still fit in what's left
+                total += size
+        return evicted
+
+    def summary(self) -> str:
+        # reads the index: call it from a worker thread
+        if not self.enabled:
+            return "media cache disabled"
+        (files, used), = self._execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM media WHERE path IS NOT NULL")
+        return (
+            f"files={files} used={used // (1 << 20)}/{self.max_bytes // (1 << 20)} MiB "
+            f"hits={self.hits} misses={self.misses} downloaded={self.downloaded} "
+            f"evicted={self.evicted} failed={self.failed} downloading={len(self._downloads)}"
+        )
+
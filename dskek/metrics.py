@@ -0,0 +1,152 @@
+from typing import Callable, Iterable
+from bisect import bisect_left
+from aiohttp import web
+import threading
+import logging
+import time
+
+
+logger = logging.getLogger("discord")
+
+BUCKETS_MS = (5, 10, 20, 50, 100, 200, 500, 1_000, 2_000, 5_000, 10_000)
+
+
+def since_ms(start: float) -> float:
+    return (time.monotonic() - start) * 1000
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = BUCKETS_MS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        # observations come from the voice threads and the event loop
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> float | None:
+        # upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def prometheus(self, labels: str) -> Iterable[str]:
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            yield f'dskek_{self.name}_bucket{{{labels},le="{bound}"}} {seen}'
+        yield f'dskek_{self.name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"dskek_{self.name}_sum{{{labels}}} {self.sum:.3f}"
+        yield f"dskek_{self.name}_count{{{labels}}} {self.count}"
+
+
+class StreamMetrics:
+    """Per-session latency histograms plus counters and gauges owned by other objects."""
+
+    def __init__(self):
+        self.queue_wait = Histogram("queue_wait_ms", "Time audio spends in the upstream queue")
+        self.ingest = Histogram("ingest_ms", "Discord receive to websocket send")
+        self.send = Histogram("send_ms", "Duration of one websocket send")
+        self.conversion = Histogram(
+            "conversion_ms", "Resampling time per batch or Gemini chunk", (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20)
+        )
+        self.first_byte = Histogram("first_byte_ms", "End of speech to first Gemini audio byte")
+        self.playback_wait = Histogram("playback_wait_ms", "Time audio spends in the playback queue")
+        self.response = Histogram("response_ms", "Mouth-to-ear: end of speech to first played frame")
+        self.counters: dict[str, Callable[[], int]] = {}
+        # levels that go down as well as up
+        self.gauges: dict[str, Callable[[], int]] = {}
+        # set when speech ends, cleared by the first byte / first played frame
+        self.speech_ended: float | None = None
+        self.awaiting_first_byte = False
+        self.awaiting_playback = False
+
+    @property
+    def histograms(self) -> tuple[Histogram, ...]:
+        return (
+            self.queue_wait,
+            self.ingest,
+            self.send,
+            self.conversion,
+            self.first_byte,
+            self.playback_wait,
+            self.response,
+        )
+
+    def speech_end(self):
+        self.speech_ended = time.monotonic()
+        self.awaiting_first_byte = True
+        self.awaiting_playback = True
+
+    def first_audio_received(self):
+        if self.awaiting_first_byte and self.speech_ended is not None:
+            self.awaiting_first_byte = False
+            self.first_byte.observe(since_ms(self.speech_ended))
+
+    def first_audio_played(self):
+        if self.awaiting_playback and self.speech_ended is not None:
+            self.awaiting_playback = False
+            self.response.observe(since_ms(self.speech_ended))
+
+    def summary(self) -> str:
+        lines = []
+        for histogram in self.histograms:
+            if histogram.count:
+                lines.append(
+                    f"{histogram.name}: n={histogram.count} "
+                    f"p50<={histogram.quantile(0.5)} p99<={histogram.quantile(0.99)}"
+                )
+        for name, value in (self.counters | self.gauges).items():
+            lines.append(f"{name}: {value()}")
+        return "\n".join(lines) or "no data yet"
+
+
+def render_prometheus(streams: dict[int, "StreamMetrics"]) -> str:
+    lines = []
+    if not streams:
+        return ""
+    any_metrics = next(iter(streams.values()))
+    for index, histogram in enumerate(any_metrics.histograms):
+        lines.append(f"# HELP dskek_{histogram.name} {histogram.help}")
+        lines.append(f"# TYPE dskek_{histogram.name} histogram")
+        for guild_id, metrics in streams.items():
+            lines.extend(metrics.histograms[index].prometheus(f'guild="{guild_id}"'))
+    for kind in ("counter", "gauge"):
+        names = sorted({name for metrics in streams.values() for name in getattr(metrics, f"{kind}s")})
+        for name in names:
+            lines.append(f"# TYPE dskek_{name} {kind}")
+            for guild_id, metrics in streams.items():
+                if value := getattr(metrics, f"{kind}s").get(name):
+                    lines.append(f'dskek_{name}{{guild="{guild_id}"}} {value()}')
+    return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(
+    collect: Callable[[], dict[int, StreamMetrics]], host: str, port: int
+) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            text=render_prometheus(collect()), content_type="text/plain", charset="utf-8"
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
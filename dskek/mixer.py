@@ -0,0 +1,87 @@
+from typing import Callable
+import numpy as np
+import time
+from dskek.converters import AudioType
+
+
+# discord's RTP clock runs at 48 kHz regardless of the decoded format
+RTP_FRAME_SAMPLES = 960
+FRAME_MS = 20
+
+
+class VoiceMixer:
+    """Lines up per-speaker 20 ms frames by RTP timestamp and sums them into
+    a single real-time stream.
+
+    output(pcm, received) gets a view of a buffer that is reused for the
+    next frame, so it has to copy what it keeps.
+    """
+
+    def __init__(
+        self,
+        output: Callable[[memoryview, float], None],
+        atype: AudioType = AudioType.DISCORD,
+        jitter_frames: int = 2,
+        max_ahead_frames: int = 25,
+    ):
+        self.output = output
+        self.atype = atype
+        self.frame_bytes = atype.value.bytes_per_ms * FRAME_MS
+        self.frame_values = self.frame_bytes // atype.value.sample_width
+        self.jitter_frames = jitter_frames
+        self.max_ahead_frames = max_ahead_frames
+        self._slots: dict[int, np.ndarray] = {}
+        self._received: dict[int, float] = {}
+        self._free: list[np.ndarray] = []
+        self._out = np.empty(self.frame_values, dtype=np.int16)
+        self._out_view = memoryview(self._out).cast("B")
+        self._offsets: dict[int, int] = {}
+        self._next_slot = 0
+        self._head = -1
+        self.mixed_frames = 0
+        self.resyncs = 0
+
+    def push(self, user_id: int, timestamp: int, pcm: bytes | memoryview, received: float | None = None):
+        rtp_slot = timestamp // RTP_FRAME_SAMPLES
+        offset = self._offsets.get(user_id)
+        slot = rtp_slot + offset if offset is not None else -1
+        if slot < self._next_slot or slot > self._next_slot + self.max_ahead_frames:
+            # new speaker, gap after silence or clock drift: put this frame at
+            # the front of the timeline and keep the speaker's cadence from here
+            slot = max(self._head, self._next_slot)
+            self._offsets[user_id] = slot - rtp_slot
+            if offset is not None:
+                self.resyncs += 1
+
+        frame = self._slots.get(slot)
+        if frame is None:
+            frame = self._free.pop() if self._free else np.empty(self.frame_values, dtype=np.int32)
+            frame.fill(0)
+            self._slots[slot] = frame
+            self._received[slot] = received or time.monotonic()
+        samples = np.frombuffer(pcm, dtype=np.int16)[: self.frame_values]
+        np.add(frame[: len(samples)], samples, out=frame[: len(samples)])
+
+        if slot > self._head:
+            self._head = slot
+        while self._head - self._next_slot >= self.jitter_frames:
+            self._emit()
+
+    def _emit(self):
+        slot = self._next_slot
+        self._next_slot += 1
+        frame = self._slots.pop(slot, None)
+        if frame is None:
+            return
+        np.clip(frame, -32768, 32767, out=frame)
+        self._out[:] = frame
+        self._free.append(frame)
+        self.mixed_frames += 1
+        self.output(self._out_view, self._received.pop(slot))
+
+    def flush(self):
+        while self._next_slot <= self._head:
+            self._emit()
+
+    def forget(self, user_id: int):
+        self._offsets.pop(user_id, None)
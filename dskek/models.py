@@ -1,4 +1,10 @@
+from enum import Enum
 from dskek.converters import AudioData, AudioType
 
 
-type QueueData = AudioData | str
+class SpeechEvent(Enum):
+    START = "start"
+    END = "end"
+
+
+type QueueData = AudioData | SpeechEvent | str
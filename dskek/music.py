@@ -0,0 +1,244 @@
+from collections import deque
+from dataclasses import dataclass
+from itertools import islice
+from typing import AsyncIterator, Awaitable, Callable
+import discord
+import asyncio
+import logging
+import threading
+
+
+logger = logging.getLogger("discord")
+
+# playlist entries listed into the queue beyond the prefetched ones
+PLAYLIST_LOOKAHEAD = 2
+
+
+@dataclass(eq=False)
+class Track:
+    query: str
+    requested_by: str
+    # resolves to a ready-to-play source; started ahead of time for prefetch
+    task: asyncio.Task | None = None
+    title: str | None = None
+
+    def __str__(self):
+        return self.title or self.query
+
+    def discard(self):
+        if self.task is None:
+            return
+        if not self.task.done():
+            self.task.cancel()
+        elif not self.task.cancelled() and self.task.exception() is None:
+            # the prefetched ffmpeg process is already running
+            self.task.result().cleanup()
+
+
+@dataclass(eq=False)
+class Playlist:
+    """Queue placeholder that expands into tracks a few at a time, so a
+    1000-entry playlist costs as much as the handful of tracks ahead."""
+
+    title: str
+    requested_by: str
+    entries: AsyncIterator[Track]
+    # tells the thread listing the entries to stop
+    stop: threading.Event
+    loaded: int = 0
+
+    def __str__(self):
+        return f"{self.title} (playlist, {self.loaded} queued so far)"
+
+    async def next(self) -> Track | None:
+        if self.stop.is_set():
+            return None
+        track = await anext(self.entries, None)
+        if track is not None:
+            self.loaded += 1
+        return track
+
+    def discard(self):
+        self.stop.set()
+
+
+class GuildPlayer:
+    """Track queue for one guild. The next `prefetch_depth` tracks are
+    resolved and their ffmpeg processes started while the current one plays,
+    so advancing doesn't wait on yt-dlp or ffmpeg startup."""
+
+    def __init__(
+        self,
+        resolve: Callable[[str], Awaitable[discord.AudioSource]],
+        prefetch_depth: int = 1,
+        max_extractions: int = 2,
+        on_play: Callable[[discord.AudioSource], None] | None = None,
+    ):
+        self.resolve = resolve
+        # called with each source once it actually starts playing
+        self.on_play = on_play
+        self.prefetch_depth = prefetch_depth
+        self.upcoming: deque[Track | Playlist] = deque()
+        self.current: Track | None = None
+        self.voice_client: discord.VoiceClient | None = None
+        self.channel: discord.abc.Messageable | None = None
+        self._extractions = asyncio.Semaphore(max_extractions)
+        self._advancing: asyncio.Task | None = None
+        self._filling: asyncio.Task | None = None
+        self._fill_lock = asyncio.Lock()
+        self._loop = asyncio.get_running_loop()
+
+    @property
+    def active(self) -> bool:
+        return self.current is not None or bool(self._advancing and not self._advancing.done())
+
+    def enqueue(
+        self, voice_client: discord.VoiceClient, channel: discord.abc.Messageable, track: Track | Playlist
+    ) -> int:
+        """Add a track, returning its position in the queue (0 = plays now)."""
+        self.voice_client = voice_client
+        self.channel = channel
+        self.upcoming.append(track)
+        position = 0
+        if self.active:
+            # until the advance task runs, the track it will start is still queued
+            position = len(self.upcoming) - (self.current is None)
+        self._schedule_fill()
+        if not self.active:
+            self._schedule_advance()
+        return position
+
+    def skip(self) -> bool:
+        if self.voice_client and self.voice_client.is_playing():
+            # the after-callback moves on to the next track
+            self.voice_client.stop()
+            return True
+        track = self.current
+        if self.active and track is not None and track.task is not None and not track.task.done():
+            # still resolving: _advance sees the cancellation and moves on
+            track.task.cancel()
+            return True
+        return False
+
+    def clear(self) -> int:
+        count = len(self.upcoming)
+        for track in self.upcoming:
+            track.discard()
+        self.upcoming.clear()
+        return count
+
+    def stop(self):
+        self.clear()
+        self.current = None
+        if self._advancing:
+            self._advancing.cancel()
+        if self.voice_client and self.voice_client.is_playing():
+            self.voice_client.stop()
+
+    def _start_resolving(self, track: Track):
+        async def resolve():
+            async with self._extractions:
+                source = await self.resolve(track.query)
+            track.title = getattr(source, "title", None) or track.title
+            return source
+
+        track.task = asyncio.create_task(resolve(), name=f"resolve-{track.query}")
+        # failures are reported when the track's turn comes
+        track.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def _prefetch(self):
+        for track in islice(self.upcoming, self.prefetch_depth):
+            if isinstance(track, Track) and track.task is None:
+                self._start_resolving(track)
+
+    def _schedule_fill(self):
+        if self._filling is None or self._filling.done():
+            self._filling = asyncio.create_task(self._fill())
+
+    async def _fill(self):
+        """List playlist entries into the window of tracks about to play,
+        then start prefetching them."""
+        async with self._fill_lock:
+            window = self.prefetch_depth + PLAYLIST_LOOKAHEAD
+            while True:
+                playlist = next(
+                    (item for item in islice(self.upcoming, window) if isinstance(item, Playlist)), None
+                )
+                if playlist is None:
+                    break
+                try:
+                    track = await playlist.next()
+                except Exception as e:
+                    logger.error(f"Failed to list {playlist.title}: {e}")
+                    track = None
+                if playlist not in self.upcoming:
+                    # cleared while we were waiting
+                    break
+                if track is None:
+                    self.upcoming.remove(playlist)
+                    continue
+                self.upcoming.insert(self.upcoming.index(playlist), track)
+            self._prefetch()
+
+    def _after(self, error: Exception | None):
+        # runs on the voice player thread
+        if error:
+            logger.error(f"Player error: {error}")
+        self._loop.call_soon_threadsafe(self._schedule_advance)
+
+    def _schedule_advance(self):
+        if self._advancing is None or self._advancing.done():
+            self._advancing = asyncio.create_task(self._advance())
+
+    async def _advance(self):
+        self.current = None
+        while self.upcoming:
+            # the head may still be an unexpanded playlist
+            await self._fill()
+            if not self.upcoming:
+                break
+            if isinstance(self.upcoming[0], Playlist):
+                # cleared and requeued with another playlist while _fill waited
+                continue
+            track = self.current = self.upcoming.popleft()
+            if track.task is None:
+                self._start_resolving(track)
+            self._schedule_fill()
+            try:
+                source = await track.task
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    # stop() cancelled us, not just this track
+                    raise
+                logger.info(f"Dropped {track.query} before it started")
+                self.current = None
+                continue
+            except Exception as e:
+                logger.error(f"Failed to resolve {track.query}: {e}")
+                await self._notify(f"Skipping **{track}**: {e}")
+                self.current = None
+                continue
+            vc = self.voice_client
+            if vc is None or not vc.is_connected():
+                source.cleanup()
+                self.current = None
+                self.clear()
+                return
+            try:
+                vc.play(source, after=self._after)
+            except discord.ClientException as e:
+                source.cleanup()
+                self.current = None
+                await self._notify(f"Can't play **{track}**: {e}")
+                return
+            if self.on_play is not None:
+                self.on_play(source)
+            await self._notify(f"**Now playing:** {track}")
+            return
+
+    async def _notify(self, text: str):
+        if self.channel is not None:
+            try:
+                await self.channel.send(text)
+            except discord.HTTPException as e:
+                logger.error(f"Failed to send music update: {e}")
@@ -1,17 +1,129 @@
-import httpx
+from dataclasses import dataclass
 from aiohttp_socks import ProxyConnector
+from dskek.env import PROXY, HTTP_POOL_LIMIT, HTTP_KEEPALIVE, DNS_CACHE_TTL
+from dskek.metrics import Histogram, since_ms
+import aiohttp
+import asyncio
+import logging
+import time
 
 
-def get_http_client(proxy: str | None = None) -> httpx.Client:
-    return httpx.Client(proxy=proxy)
+logger = logging.getLogger("discord")
 
-def get_async_http_client(proxy: str | None = None) -> httpx.AsyncClient:
-    return httpx.AsyncClient(proxy=proxy)
 
-def get_aio_proxy_connector(proxy: str) -> ProxyConnector:
-    return ProxyConnector.from_url(proxy)
+@dataclass
+class PoolConfig:
+    proxy: str | None = None
+    # 0 = no limit
+    limit: int = HTTP_POOL_LIMIT
+    keepalive: float = HTTP_KEEPALIVE
+    dns_ttl: int = DNS_CACHE_TTL
+
+
+class PoolStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.connect = Histogram(f"{name}_connect_ms", "New connection setup, including proxy and TLS")
+        self.dns = Histogram(f"{name}_dns_ms", "DNS resolution that missed the cache")
+        self.requests = 0
+        self.created = 0
+        self.reused = 0
+        self.dns_hits = 0
+
+    def summary(self) -> str:
+        return (
+            f"{self.name}: requests={self.requests} new={self.created} reused={self.reused} "
+            f"dns_hits={self.dns_hits} connect p50<={self.connect.quantile(0.5)} "
+            f"p99<={self.connect.quantile(0.99)}"
+        )
+
+
+class ConnectionPools:
+    """Process-wide aiohttp connectors, one per named destination.
+
+    Each pool has its own proxy, connection limit, keep-alive and DNS cache,
+    and is shared by everything talking to that destination, so requests
+    reuse warm TCP/TLS/SOCKS connections instead of building a new chain
+    every time. Connectors handed out here are shared: don't close them.
+    """
+
+    def __init__(self, configs: dict[str, PoolConfig]):
+        self.configs = configs
+        self.stats: dict[str, PoolStats] = {}
+        self._connectors: dict[str, aiohttp.BaseConnector] = {}
+
+    def config(self, name: str) -> PoolConfig:
+        return self.configs.setdefault(name, PoolConfig())
+
+    def _stats(self, name: str) -> PoolStats:
+        if name not in self.stats:
+            self.stats[name] = PoolStats(name)
+        return self.stats[name]
+
+    def connector(self, name: str) -> aiohttp.BaseConnector:
+        """Shared aiohttp connector; must be first requested on the event loop."""
+        connector = self._connectors.get(name)
+        if connector is None or connector.closed:
+            config = self.config(name)
+            options = dict(
+                limit=config.limit,
+                keepalive_timeout=config.keepalive,
+                ttl_dns_cache=config.dns_ttl,
+            )
+            if config.proxy:
+                connector = ProxyConnector.from_url(config.proxy, **options)
+            else:
+                connector = aiohttp.TCPConnector(**options)
+            self._connectors[name] = connector
+        return connector
+
+    def trace(self, name: str) -> aiohttp.TraceConfig:
+        stats = self._stats(name)
+        trace = aiohttp.TraceConfig()
+
+        async def request_start(session, ctx, params):
+            stats.requests += 1
+
+        async def create_start(session, ctx, params):
+            ctx.connect_started = time.monotonic()
+
+        async def create_end(session, ctx, params):
+            stats.created += 1
+            stats.connect.observe(since_ms(ctx.connect_started))
+
+        async def reuse(session, ctx, params):
+            stats.reused += 1
+
+        async def dns_start(session, ctx, params):
+            ctx.dns_started = time.monotonic()
+
+        async def dns_end(session, ctx, params):
+            stats.dns.observe(since_ms(ctx.dns_started))
+
+        async def dns_hit(session, ctx, params):
+            stats.dns_hits += 1
+
+        trace.on_request_start.append(request_start)
+        trace.on_connection_create_start.append(create_start)
+        trace.on_connection_create_end.append(create_end)
+        trace.on_connection_reuseconn.append(reuse)
+        trace.on_dns_resolvehost_start.append(dns_start)
+        trace.on_dns_resolvehost_end.append(dns_end)
+        trace.on_dns_cache_hit.append(dns_hit)
+        return trace
+
+    async def close(self):
+        await asyncio.gather(*(connector.close() for connector in self._connectors.values()), return_exceptions=True)
+        self._connectors.clear()
+
+    def summary(self) -> str:
+        return "\n".join(stats.summary() for stats in self.stats.values()) or "no HTTP traffic yet"
+
+
+connections = ConnectionPools(
+    {
+        # the gateway and every voice websocket hold a connection here too
+        "discord": PoolConfig(proxy=PROXY, limit=0),
+    }
+)
 
-def get_aio_proxy_connector_checked(proxy: str | None) -> ProxyConnector | None:
-    if not proxy:
-        return
-    return ProxyConnector.from_url(proxy)
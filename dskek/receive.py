@@ -0,0 +1,138 @@
+from dskek.converters import AudioType, PCMFrame
+from dskek.env import RECEIVE_WORKERS
+from typing import Protocol
+import ctypes
+import discord
+import logging
+import os
+import queue
+import threading
+import time
+
+
+logger = logging.getLogger("discord")
+
+# packets handled per wake-up of a worker
+RECEIVE_BATCH = 64
+
+
+class OpusDecoder(discord.opus.Decoder):
+    """Decodes discord's 48 kHz stereo Opus straight to what Gemini takes;
+    libopus resamples and downmixes internally, much cheaper than doing it
+    on 6x as much PCM in numpy."""
+
+    SAMPLING_RATE = AudioType.GEMINI_SEND.value.sample_rate
+    CHANNELS = AudioType.GEMINI_SEND.value.channels
+    SAMPLE_SIZE = AudioType.GEMINI_SEND.value.frame_size
+    SAMPLES_PER_FRAME = SAMPLING_RATE // 1000 * discord.opus.Decoder.FRAME_LENGTH
+    FRAME_SIZE = SAMPLES_PER_FRAME * SAMPLE_SIZE
+
+    def decode_into(self, frame: PCMFrame):
+        """Decode frame.opus into the frame's own buffer, without the
+        temporary arrays Decoder.decode goes through."""
+        opus = frame.opus or None
+        buffer = frame.buffer
+        capacity = len(buffer) // self.SAMPLE_SIZE
+        if opus is None:
+            # voice_recv stands in empty packets for lost ones; let libopus conceal them
+            samples = min(self._get_last_packet_duration() or self.SAMPLES_PER_FRAME, capacity)
+        else:
+            samples = capacity
+        pcm = (ctypes.c_int16 * (len(buffer) // 2)).from_buffer(buffer)
+        decoded = discord.opus._lib.opus_decode(
+            self._state, opus, len(opus) if opus else 0, ctypes.cast(pcm, discord.opus.c_int16_ptr), samples, 0
+        )
+        del pcm
+        frame.set_length(decoded * self.SAMPLE_SIZE)
+
+
+class ReceivePipeline(Protocol):
+    def process(self, items: list[PCMFrame | tuple]): ...
+
+
+class ReceiveWorker(threading.Thread):
+    """Drains raw packets for the pipelines assigned to it. Each pipeline
+    always lands on the same worker, so its packets stay in order.
+
+    Packets arrive as PCMFrames owned by their pipeline, anything else as
+    a (pipeline, item) pair.
+    """
+
+    def __init__(self, index: int):
+        super().__init__(name=f"voice-receive-{index}", daemon=True)
+        self.queue: queue.SimpleQueue[PCMFrame | tuple[ReceivePipeline, tuple]] = queue.SimpleQueue()
+        self.pipelines = 0
+        self.items = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.started = time.monotonic()
+
+    def submit_frame(self, frame: PCMFrame):
+        self.queue.put(frame)
+
+    def submit(self, pipeline: ReceivePipeline, item: tuple):
+        self.queue.put((pipeline, item))
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < RECEIVE_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            # group by pipeline, keeping each pipeline's own order
+            grouped: dict[int, tuple[ReceivePipeline, list[PCMFrame | tuple]]] = {}
+            for entry in batch:
+                if isinstance(entry, PCMFrame):
+                    pipeline, item = entry.owner, entry
+                else:
+                    pipeline, item = entry
+                grouped.setdefault(id(pipeline), (pipeline, []))[1].append(item)
+            for pipeline, items in grouped.values():
+                try:
+                    pipeline.process(items)
+                except Exception as e:
+                    logger.exception(f"Voice receive pipeline failed: {e}")
+            self.busy += time.perf_counter() - started
+            self.items += len(batch)
+            self.batches += 1
+
+    def summary(self) -> str:
+        elapsed = time.monotonic() - self.started
+        return (
+            f"{self.name}: pipelines={self.pipelines} items/s={self.items / elapsed:.0f} "
+            f"avg batch={self.items / max(self.batches, 1):.1f} busy={100 * self.busy / elapsed:.1f}%"
+        )
+
+
+class ReceiveWorkers:
+    """Thread pool, one thread per core by default, that takes the per-packet
+    work (Opus decoding, VAD, mixing, resampling) off the voice_recv socket
+    thread. libopus runs without the GIL, so decoding scales across them."""
+
+    def __init__(self, workers: int | None = None):
+        self.size = workers or os.cpu_count() or 1
+        self._workers: list[ReceiveWorker] = []
+        self._lock = threading.Lock()
+
+    def assign(self) -> ReceiveWorker:
+        with self._lock:
+            if not self._workers:
+                self._workers = [ReceiveWorker(index) for index in range(self.size)]
+                for worker in self._workers:
+                    worker.start()
+            worker = min(self._workers, key=lambda w: w.pipelines)
+            worker.pipelines += 1
+            return worker
+
+    def release(self, worker: ReceiveWorker):
+        with self._lock:
+            worker.pipelines -= 1
+
+    def summary(self) -> str:
+        return "\n".join(worker.summary() for worker in self._workers) or "receive workers idle"
+
+
+receive_workers = ReceiveWorkers(RECEIVE_WORKERS)
@@ -0,0 +1,168 @@
+from dskek.channels import StreamController
+from dskek.env import MAX_GEMINI_SESSIONS, SESSION_IDLE_TIMEOUT
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable
+from discord.ext import voice_recv
+import discord
+import asyncio
+import logging
+import time
+
+if TYPE_CHECKING:
+    from dskek.voicebot import VoiceBot
+
+
+logger = logging.getLogger("discord")
+
+IDLE_CHECK_INTERVAL = 30
+
+
+class SessionError(Exception):
+    pass
+
+
+@dataclass
+class GuildSession:
+    guild_id: int
+    voice_client: voice_recv.VoiceRecvClient
+    voice: "VoiceBot"
+    task: asyncio.Task | None = None
+    started: float = field(default_factory=time.monotonic)
+
+
+class SessionManager:
+    """One Stream/VoiceBot/AudioLoop per guild, each running as a background task."""
+
+    def __init__(
+        self,
+        factory: Callable[..., "VoiceBot"],
+        controller: StreamController | None = None,
+        max_sessions: int = MAX_GEMINI_SESSIONS,
+        idle_timeout: float = SESSION_IDLE_TIMEOUT,
+    ):
+        self.factory = factory
+        self.controller = controller or StreamController()
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions: dict[int, GuildSession] = {}
+        self._reaper: asyncio.Task | None = None
+        self._background: set[asyncio.Task] = set()
+        # guilds whose voice connection is being set up; reserved before the
+        # first await, so joins for the same guild can't race each other
+        self._joining: set[int] = set()
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self.sessions
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    @property
+    def in_use(self) -> int:
+        """Guilds holding (or about to hold) a Gemini session."""
+        return len(self.sessions) + len(self._joining)
+
+    async def start(self, voice_channel: discord.VoiceChannel, **options) -> GuildSession:
+        guild_id = voice_channel.guild.id
+        if guild_id in self.sessions or guild_id in self._joining:
+            raise SessionError("I'm already in a voice channel.")
+        if self.in_use >= self.max_sessions:
+            raise SessionError(
+                f"All {self.max_sessions} voice sessions are busy, try again later."
+            )
+        self._joining.add(guild_id)
+        try:
+            return await self._start(guild_id, voice_channel, **options)
+        finally:
+            self._joining.discard(guild_id)
+
+    async def _start(self, guild_id: int, voice_channel: discord.VoiceChannel, **options) -> GuildSession:
+        stream = self.controller.create_stream(guild_id)
+        try:
+            vc = await voice_channel.connect(cls=voice_recv.VoiceRecvClient)
+        except BaseException:
+            self.controller.remove_stream(guild_id)
+            raise
+        try:
+            voice = self.factory(stream=stream, **options)
+            vc.listen(voice)
+            vc.play(voice)
+        except BaseException:
+            if vc.is_listening():
+                vc.stop_listening()
+            await vc.disconnect(force=True)
+            self.controller.remove_stream(guild_id)
+            raise
+        session = GuildSession(guild_id=guild_id, voice_client=vc, voice=voice)
+        self.sessions[guild_id] = session
+        session.task = asyncio.create_task(
+            self._run(session), name=f"gemini-session-{guild_id}"
+        )
+        self._ensure_reaper()
+        logger.info(f"Started session for guild {guild_id} ({len(self.sessions)} active)")
+        return session
+
+    async def _run(self, session: GuildSession):
+        try:
+            await session.voice.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"Session for guild {session.guild_id} failed: {e}")
+        finally:
+            # the session ended on its own (or failed): release the guild
+            if self.sessions.get(session.guild_id) is session:
+                task = asyncio.create_task(self.stop(session.guild_id, reason="session ended"))
+                self._background.add(task)
+                task.add_done_callback(self._background.discard)
+
+    async def stop(self, guild_id: int, reason: str = "requested"):
+        session = self.sessions.pop(guild_id, None)
+        if session is None:
+            return False
+        logger.info(f"Stopping session for guild {guild_id}: {reason}")
+        if session.task and not session.task.done():
+            session.task.cancel()
+            try:
+                await session.task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"Session for guild {guild_id} raised on shutdown: {e}")
+        vc = session.voice_client
+        if vc.is_listening():
+            vc.stop_listening()
+        if vc.is_playing():
+            vc.stop()
+        if vc.is_connected():
+            await vc.disconnect()
+        self.controller.remove_stream(guild_id)
+        return True
+
+    async def shutdown(self):
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        await asyncio.gather(
+            *(self.stop(guild_id, reason="shutdown") for guild_id in list(self.sessions)),
+            return_exceptions=True,
+        )
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle(), name="gemini-session-reaper")
+
+    def _is_idle(self, session: GuildSession) -> bool:
+        vc = session.voice_client
+        if not vc.is_connected():
+            return True
+        if not any(not member.bot for member in vc.channel.members):
+            return True
+        return time.monotonic() - session.voice.last_activity > self.idle_timeout
+
+    async def _reap_idle(self):
+        while self.sessions:
+            await asyncio.sleep(IDLE_CHECK_INTERVAL)
+            for guild_id, session in list(self.sessions.items()):
+                if self._is_idle(session):
+                    await self.stop(guild_id, reason="idle")
@@ -0,0 +1,66 @@
+import numpy as np
+from dskek.models import SpeechEvent
+
+
+# RMS in int16 units, roughly -40 dBFS
+VAD_THRESHOLD = 330
+# how long a speaker stays "active" after the last loud frame
+VAD_HANGOVER_MS = 400
+
+
+class EnergyVAD:
+    def __init__(self, threshold: float = VAD_THRESHOLD, hangover_ms: int = VAD_HANGOVER_MS):
+        # compare mean squares, no need for a sqrt per frame
+        self.threshold_sq = float(threshold) ** 2
+        self.hangover_frames = hangover_ms // 20
+        self.active = False
+        self._quiet_frames = 0
+
+    def update(self, pcm: bytes | memoryview) -> bool:
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        loud = len(samples) > 0 and float(np.dot(samples, samples)) / len(samples) > self.threshold_sq
+        if loud:
+            self.active = True
+            self._quiet_frames = 0
+        elif self.active:
+            self._quiet_frames += 1
+            if self._quiet_frames > self.hangover_frames:
+                self.active = False
+        return self.active
+
+    def reset(self):
+        self.active = False
+        self._quiet_frames = 0
+
+
+class SpeechGate:
+    """Per-user VAD that reports when the channel as a whole starts and stops talking."""
+
+    def __init__(self, threshold: float = VAD_THRESHOLD, hangover_ms: int = VAD_HANGOVER_MS):
+        self.threshold = threshold
+        self.hangover_ms = hangover_ms
+        self._vads: dict[int, EnergyVAD] = {}
+        self.speakers: set[int] = set()
+        self.passed_frames = 0
+        self.dropped_frames = 0
+
+    def update(self, user_id: int, pcm: bytes | memoryview) -> tuple[bool, SpeechEvent | None]:
+        vad = self._vads.get(user_id)
+        if vad is None:
+            vad = self._vads[user_id] = EnergyVAD(self.threshold, self.hangover_ms)
+        was_speaking = bool(self.speakers)
+        if vad.update(pcm):
+            self.passed_frames += 1
+            self.speakers.add(user_id)
+            return True, None if was_speaking else SpeechEvent.START
+        self.dropped_frames += 1
+        return False, self.drop(user_id)
+
+    def drop(self, user_id: int) -> SpeechEvent | None:
+        # used both for hangover expiry and for users who simply stop sending
+        if user_id in self._vads:
+            self._vads[user_id].reset()
+        if user_id not in self.speakers:
+            return None
+        self.speakers.discard(user_id)
+        return None if self.speakers else SpeechEvent.END
@@ -1,79 +1,404 @@
 from dskek.discord_bot import bot
-from dskek.channels import Stream
-from dskek.converters import AudioType, AudioData
-from dskek.gemini import AudioLoop
+from dskek.channels import Stream, PCMRingBuffer
+from dskek.converters import AudioType, AudioData, FramePool, PCMFrame, Resampler, convert_pcm
+from dskek.gemini import AudioLoop, connect_live
+from dskek.live_pool import LiveSessionPool
+from dskek.mixer import VoiceMixer
+from dskek.models import SpeechEvent
+from dskek.vad import SpeechGate
+from dskek.sessions import SessionManager, SessionError
+from dskek.metrics import since_ms, start_metrics_server
+from dskek.proxy_clients import connections
+from dskek.receive import OpusDecoder, receive_workers
+from dskek.env import (
+    WAKE_WORD,
+    VOSK_MODEL_PATH,
+    METRICS_HOST,
+    METRICS_PORT,
+    LIVE_POOL_SIZE,
+    LIVE_POOL_MAX_IDLE,
+    VOICE_RECV_OPUS,
+)
 from discord.ext import voice_recv, commands
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from functools import partial
+from typing import Callable
 import discord
 import asyncio
+import json
 import logging
+import threading
 import traceback
 import time
 
 
 logger = logging.getLogger("discord")
 
+PLAYBACK_BUFFER_MS = 10_000
+DIALOG_TIMEOUT = 30
+WAKE_WORD_PREROLL_MS = 4_000
+WAKE_WORD_WORKERS = 2
+# libopus packets can carry up to 120 ms
+OPUS_MAX_FRAME_MS = 120
+# speech it takes to cut the bot off; a cough or a short "mm" doesn't
+BARGE_IN_MIN_MS = 300
+
+
+class VoskRecognizer:
+    def __init__(self, model_path: str | None = VOSK_MODEL_PATH):
+        try:
+            import vosk
+        except ImportError as e:
+            raise RuntimeError("Wake-word mode needs the optional `vosk` package") from e
+        self._vosk = vosk
+        self.model = vosk.Model(model_path) if model_path else vosk.Model(lang="ru")
+
+    def recognize(self, pcm: bytes, sample_rate: int) -> str:
+        recognizer = self._vosk.KaldiRecognizer(self.model, sample_rate)
+        recognizer.AcceptWaveform(pcm)
+        return json.loads(recognizer.FinalResult()).get("text", "")
+
+
+class WakeWordGate:
+    """Keeps per-user dialog state; users outside a dialog are only heard by
+    the local recognizer until they say the wake word."""
+
+    _recognizer: VoskRecognizer | None = None
+    _recognizer_lock = threading.Lock()
+    _pool = ThreadPoolExecutor(max_workers=WAKE_WORD_WORKERS, thread_name_prefix="wakeword")
+
+    def __init__(
+        self,
+        on_wake: Callable[[int, list[tuple[int, bytes]]], None],
+        wake_word: str = WAKE_WORD,
+        dialog_timeout: float = DIALOG_TIMEOUT,
+        preroll_ms: int = WAKE_WORD_PREROLL_MS,
+        atype: AudioType = AudioType.DISCORD,
+    ):
+        self.on_wake = on_wake
+        self.atype = atype
+        self.wake_word = wake_word.lower()
+        self.dialog_timeout = dialog_timeout
+        self.preroll_frames = preroll_ms // 20
+        self._utterances: dict[int, deque[tuple[int, bytes]]] = {}
+        self._dialogs: dict[int, float] = {}
+        self._recognizing: set[int] = set()
+
+    @classmethod
+    def recognizer(cls) -> VoskRecognizer:
+        # the model is big, share one across sessions and workers
+        if cls._recognizer is None:
+            with cls._recognizer_lock:
+                if cls._recognizer is None:
+                    cls._recognizer = VoskRecognizer()
+        return cls._recognizer
+
+    def in_dialog(self, user_id: int) -> bool:
+        last = self._dialogs.get(user_id)
+        if last is None:
+            return False
+        now = time.monotonic()
+        if now - last > self.dialog_timeout:
+            del self._dialogs[user_id]
+            logger.info(f"User {user_id} left the conversation")
+            return False
+        self._dialogs[user_id] = now
+        return True
+
+    def buffer(self, user_id: int, timestamp: int, pcm: bytes):
+        utterance = self._utterances.get(user_id)
+        if utterance is None:
+            utterance = self._utterances[user_id] = deque(maxlen=self.preroll_frames)
+        utterance.append((timestamp, pcm))
+
+    def end_utterance(self, user_id: int):
+        utterance = self._utterances.get(user_id)
+        if not utterance or user_id in self._recognizing:
+            return
+        frames = list(utterance)
+        utterance.clear()
+        self._recognizing.add(user_id)
+        future = self._pool.submit(self._recognize, frames)
+        future.add_done_callback(lambda f: self._recognized(user_id, frames, f))
+
+    def _recognize(self, frames: list[tuple[int, bytes]]) -> str:
+        pcm = convert_pcm(
+            b"".join(pcm for _, pcm in frames),
+            self.atype.value,
+            AudioType.GEMINI_SEND.value,
+        )
+        return self.recognizer().recognize(pcm, AudioType.GEMINI_SEND.value.sample_rate)
+
+    def _recognized(self, user_id: int, frames: list[tuple[int, bytes]], future: Future):
+        self._recognizing.discard(user_id)
+        try:
+            text = future.result().lower()
+        except Exception as e:
+            logger.error(f"Wake-word recognition failed: {e}")
+            return
+        if self.wake_word in text:
+            self._dialogs[user_id] = time.monotonic()
+            self.on_wake(user_id, frames)
+
 
 class VoiceBot(discord.AudioSource, voice_recv.AudioSink):
-    def __init__(self):
+    def __init__(
+        self,
+        stream: Stream | None = None,
+        wake_word: bool = False,
+        opus: bool = VOICE_RECV_OPUS,
+        **audio_options,
+    ):
         discord.AudioSource.__init__(self)
         voice_recv.AudioSink.__init__(self)
-        self.stream = Stream()
-        self.audio = AudioLoop(self.stream)
+        self.stream = stream or Stream()
+        self.audio = AudioLoop(self.stream, **audio_options)
         self.write_time = time.time()
         self.write_bytes = 0
-        self.audio_buffer = b""
+        self.last_activity = time.monotonic()
+        self.playback = PCMRingBuffer(
+            PLAYBACK_BUFFER_MS * AudioType.DISCORD.value.bytes_per_ms,
+            AudioType.DISCORD.value.chunk_size,
+        )
+        self._pending_out: AudioData | None = None
+        # everything below is only touched by the receive worker; the
+        # voice_recv threads just hand packets over
+        self._receiver = receive_workers.assign()
+        # in opus mode each speaker gets a decoder that outputs Gemini's format,
+        # so nothing downstream ever sees 48 kHz stereo
+        self.opus = opus
+        self.input_type = AudioType.GEMINI_SEND if opus else AudioType.DISCORD
+        self._decoders: dict[int, OpusDecoder] = {}
+        # packets travel to the worker in recycled frames, not fresh objects
+        self.frames = FramePool(self.input_type, OPUS_MAX_FRAME_MS, owner=self)
+        # one mixed frame per 20 ms no matter how many people are talking
+        self._mixed = bytearray()
+        self._mixed_received: float | None = None
+        self.mixer = VoiceMixer(self._collect_mixed, self.input_type)
+        self._to_gemini = Resampler(self.input_type, AudioType.GEMINI_SEND)
+        self.gate = SpeechGate()
+        self.wake_words = WakeWordGate(self._on_wake, atype=self.input_type) if wake_word else None
+        self._speaking = False
+        # speech sent upstream in the current utterance
+        self._speech_ms = 0
+        self._sequences: dict[int, int] = {}
+        self.lost_packets = 0
+        self._closed = False
+        self.stream.metrics.counters.update(
+            vad_passed_frames=lambda: self.gate.passed_frames,
+            vad_dropped_frames=lambda: self.gate.dropped_frames,
+            mixed_frames=lambda: self.mixer.mixed_frames,
+            mixer_resyncs=lambda: self.mixer.resyncs,
+            lost_packets=lambda: self.lost_packets,
+            receive_frames_allocated=lambda: self.frames.allocated,
+            playback_underruns=lambda: self.playback.underruns,
+        )
 
     async def run(self):
         await self.audio.run()
 
     def wants_opus(self):
-        return False
+        return self.opus
 
     def is_opus(self):
         return False
 
-    # def read(self):
-    #     if not self.audio_buffer:
-    #         nxt: AudioData = self.stream.audio_out_queue.get()
-    #         next_converted = nxt.convert(AudioType.DISCORD)
-    #         self.audio_buffer = next_converted.data.raw_data
-    #     discord_chunk_size = AudioType.DISCORD.value.chunk_size
-    #     if len(self.audio_buffer) < discord_chunk_size:
-    #         if self.stream.audio_out_queue.empty():
-    #             self.audio_buffer += b"\x00" * (discord_chunk_size - len(self.audio_buffer))
-    #         else:
-    #             nxt: AudioData = self.stream.audio_out_queue.get()
-    #             next_converted = nxt.convert(AudioType.DISCORD)
-    #             self.audio_buffer += next_converted.data.raw_data
-    #     chunk = self.audio_buffer[:discord_chunk_size]
-    #     self.audio_buffer = self.audio_buffer[discord_chunk_size:]
-    #     return chunk
+    def _fill_playback(self):
+        # move converted audio into the ring while it fits; whatever doesn't
+        # waits in the queue, so nothing is dropped here
+        while True:
+            if self._pending_out is None:
+                if self.stream.audio_out_queue.empty():
+                    return
+                self._pending_out = self.stream.audio_out_queue.get_nowait()
+            if len(self._pending_out.data) > self.playback.free:
+                return
+            self.playback.write(self._pending_out.data)
+            self.stream.metrics.playback_wait.observe(since_ms(self._pending_out.enqueued))
+            self._pending_out = None
+            self.last_activity = time.monotonic()
+
+    def _flush_playback(self):
+        millis = len(self.playback) // AudioType.DISCORD.value.bytes_per_ms
+        self.playback.clear()
+        if self._pending_out is not None:
+            millis += self._pending_out.duration_ms
+            self._pending_out = None
+        millis += self.stream.drain_out()
+        if millis:
+            self.stream.barge_ins += 1
+            self.stream.discard(millis)
+            logger.info(f"Barge-in: dropped {millis} ms of queued playback")
 
     def read(self):
-        if not self.stream.audio_out_queue.empty():
-            chunk: AudioData = self.stream.audio_out_queue.get()
-            logger.info(f"Bot is reading {len(chunk.data.raw_data)} bytes of audio")
-            return chunk.convert(AudioType.DISCORD).data.raw_data
+        if self.stream.take_interrupt():
+            self._flush_playback()
+        self._fill_playback()
+        if len(self.playback):
+            self.stream.metrics.first_audio_played()
+        return self.playback.read_frame(expecting=self.audio.responding)
 
     def write(self, user: discord.Member, data: voice_recv.VoiceData):
         if user:
-            self.stream.audio_in_queue.put_nowait(
-                AudioData.from_raw(data=data.pcm, atype=AudioType.DISCORD)
+            frame = self.frames.get()
+            frame.user_id = user.id
+            frame.timestamp = data.packet.timestamp
+            frame.sequence = data.packet.sequence
+            frame.received = time.monotonic()
+            if self.opus:
+                frame.opus = data.opus
+            else:
+                frame.data = data.pcm
+            self._receiver.submit_frame(frame)
+
+    def process(self, items: list[PCMFrame | tuple]):
+        # runs on the receive worker, in arrival order
+        if self._closed:
+            return
+        for item in items:
+            if isinstance(item, PCMFrame):
+                self._on_frame(item)
+                item.release()
+                continue
+            kind, user_id, *args = item
+            if kind in ("stop", "leave"):
+                was_speaking = user_id in self.gate.speakers
+                event = self.gate.drop(user_id)
+                if was_speaking:
+                    self._end_utterance(user_id, event)
+                if kind == "leave":
+                    # a returning user starts over with a new RTP clock
+                    self.mixer.forget(user_id)
+                    self._decoders.pop(user_id, None)
+                    self._sequences.pop(user_id, None)
+            elif kind == "wake":
+                logger.info(f"User {user_id} joined the conversation")
+                for timestamp, pcm in args[0]:
+                    self._push(user_id, timestamp, pcm)
+                if not self.gate.speakers:
+                    self._end_utterance(user_id, SpeechEvent.END)
+            elif kind == "close":
+                self._closed = True
+                self._decoders.clear()
+                self.mixer.flush()
+                receive_workers.release(self._receiver)
+                break
+        self._send_mixed()
+        if time.time() - self.write_time > 10:
+            logger.info(
+                f"Bot has written {self.write_bytes=} of audio over 10s"
             )
-            if time.time() - self.write_time > 10:
-                logger.info(
-                    f"Bot has written {self.write_bytes=} of audio over 10s"
-                )
-                self.write_time = time.time()
-                self.write_bytes = 0
+            self.write_time = time.time()
+            self.write_bytes = 0
+
+    def _on_frame(self, frame: PCMFrame):
+        user_id = frame.user_id
+        last = self._sequences.get(user_id)
+        if last is not None:
+            gap = (frame.sequence - last - 1) & 0xFFFF
+            if gap < 0x8000:
+                self.lost_packets += gap
+        self._sequences[user_id] = frame.sequence
+        if self.opus:
+            self._decode(frame)
+        pcm = frame.data
+        was_speaking = user_id in self.gate.speakers
+        speech, event = self.gate.update(user_id, pcm)
+        if speech:
+            # silent frames never reach the mixer or the resampler
+            if self.wake_words is None or self.wake_words.in_dialog(user_id):
+                self._push(user_id, frame.timestamp, pcm, frame.received)
+            else:
+                # the frame goes back to the pool, the preroll keeps a copy
+                self.wake_words.buffer(user_id, frame.timestamp, bytes(pcm))
+        elif was_speaking:
+            self._end_utterance(user_id, event)
+
+    def _decode(self, frame: PCMFrame):
+        decoder = self._decoders.get(frame.user_id)
+        if decoder is None:
+            decoder = self._decoders[frame.user_id] = OpusDecoder()
+        try:
+            decoder.decode_into(frame)
+        except discord.opus.OpusError as e:
+            logger.warning(f"Dropping undecodable packet from {frame.user_id}: {e}")
+            frame.set_length(0)
+
+    def _collect_mixed(self, pcm: memoryview, received: float):
+        if not self._mixed:
+            self._mixed_received = received
+        self._mixed += pcm
+
+    def _send_mixed(self, flush: bool = False):
+        # one resampling pass for all frames mixed from this batch
+        if self._mixed:
+            started = time.monotonic()
+            pcm = self._to_gemini.process(self._mixed)
+            self.stream.metrics.conversion.observe(since_ms(started))
+            received = self._mixed_received
+            self._mixed = bytearray()
+        else:
+            pcm = b""
+            received = None
+        if flush:
+            pcm += self._to_gemini.flush()
+        if pcm:
+            self.stream.put_in(AudioData(data=pcm, atype=AudioType.GEMINI_SEND, received=received))
+
+    def _push(self, user_id: int, timestamp: int, pcm: bytes | memoryview, received: float | None = None):
+        if not self._speaking:
+            self._speaking = True
+            self._speech_ms = 0
+            self._send_mixed()
+            self.stream.put_in(SpeechEvent.START)
+        speech_ms = self._speech_ms
+        self._speech_ms += len(pcm) // self.input_type.value.bytes_per_ms
+        if speech_ms < BARGE_IN_MIN_MS <= self._speech_ms:
+            # only gated (and in wake mode, woken) speakers get here
+            self.stream.interrupt()
+        self.mixer.push(user_id, timestamp, pcm, received)
+        self.write_bytes += len(pcm)
+        self.last_activity = time.monotonic()
+
+    def _end_utterance(self, user_id: int, event: SpeechEvent | None):
+        if self.wake_words is not None:
+            self.wake_words.end_utterance(user_id)
+        if event is SpeechEvent.END and self._speaking:
+            self._speaking = False
+            self.mixer.flush()
+            self._send_mixed(flush=True)
+            self.stream.put_in(SpeechEvent.END)
+            self.stream.metrics.speech_end()
+
+    def _on_wake(self, user_id: int, frames: list[tuple[int, bytes]]):
+        # called from the recognizer pool once the wake word was heard
+        self._receiver.submit(self, ("wake", user_id, frames))
+
+    @voice_recv.AudioSink.listener()
+    def on_voice_member_speaking_stop(self, member: discord.Member):
+        # discord stops sending packets on silence, so the hangover may never run out
+        self._receiver.submit(self, ("stop", member.id))
+
+    @voice_recv.AudioSink.listener()
+    def on_voice_member_disconnect(self, member: discord.Member, ssrc: int | None):
+        self._receiver.submit(self, ("leave", member.id))
 
     def cleanup(self):
+        self._receiver.submit(self, ("close", None))
         self.stream.cleanup()
         return super().cleanup()
 
 
+# warm sessions share MAX_GEMINI_SESSIONS with the guilds using one
+live_pool = LiveSessionPool(
+    connect_live, LIVE_POOL_SIZE, LIVE_POOL_MAX_IDLE, spare=lambda: sessions.max_sessions - sessions.in_use
+)
+sessions = SessionManager(partial(VoiceBot, connect=live_pool.connect))
+
+
 @bot.command("join")
-async def on_join(ctx: commands.Context):
+async def on_join(ctx: commands.Context, mode: str = ""):
     if ctx.author == bot.user:
         return
     if not ctx.author.voice:
@@ -84,25 +409,66 @@ async def on_join(ctx: commands.Context):
     voice_channel = ctx.author.voice.channel
     guild_id = ctx.guild.id
 
-    if guild_id in bot.voice_clients:
+    if guild_id in sessions or ctx.guild.voice_client is not None:
         logger.info(f"Bot is already in a voice channel for guild {guild_id}.")
         await ctx.reply("I'm already in a voice channel.")
         return
 
+    if mode == "wake":
+        try:
+            # load the model now, so a missing one fails the command instead of every utterance
+            await asyncio.to_thread(WakeWordGate.recognizer)
+        except Exception as e:
+            logger.error(f"Wake-word recognizer unavailable: {e}")
+            await ctx.reply(f"Wake-word mode is unavailable: {e}")
+            return
+
     try:
         logger.info(f"Attempting to join voice channel for guild {guild_id}.")
-        vc = await voice_channel.connect(cls=voice_recv.VoiceRecvClient)
-
-        logger.info(f"Joined voice channel for guild {guild_id}.")
-        gemini = VoiceBot()
-
-        logger.info(f"Starting listen and play for guild {guild_id}.")
-        vc.listen(gemini)
-        vc.play(gemini)
-
+        await sessions.start(voice_channel, wake_word=mode == "wake")
         await ctx.reply("Joined voice channel. Starting Gemini stream...")
-        logger.info(f"Starting gemini stream for guild {guild_id}.")
-        await gemini.run()
+    except SessionError as e:
+        await ctx.reply(str(e))
     except Exception as e:
         logger.exception(f"Bot error: {e}\n{traceback.format_exc()}")
         await ctx.reply(f"Exception: {e}")
+
+
+@bot.listen("on_voice_state_update")
+async def on_bot_voice_state(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    # covers !leave, being kicked and being dragged out of the channel
+    if member == bot.user and after.channel is None:
+        await sessions.stop(member.guild.id, reason="disconnected")
+
+
+bot.shutdown_callbacks.append(sessions.shutdown)
+bot.shutdown_callbacks.append(live_pool.close)
+
+
+@bot.command("stats", help="Latency and drop statistics for this guild's voice session")
+async def on_stats(ctx: commands.Context):
+    if ctx.guild.id not in sessions:
+        await ctx.reply("I'm not in a voice channel. Use `!join` first.")
+        return
+    summary = sessions.controller[ctx.guild.id].metrics.summary()
+    pool = f"live pool: ready={len(live_pool)} hits={live_pool.hits} misses={live_pool.misses}"
+    await ctx.reply(f"```\n{summary}\n{pool}\n{receive_workers.summary()}\n```")
+
+
+@bot.command("net", help="Connection pool statistics")
+async def on_net(ctx: commands.Context):
+    await ctx.reply(f"```\n{connections.summary()}\n```")
+
+
+_metrics_server = None
+
+
+@bot.listen("on_ready")
+async def on_metrics_ready():
+    global _metrics_server
+    if METRICS_PORT and _metrics_server is None:
+        _metrics_server = await start_metrics_server(
+            lambda: {guild_id: stream.metrics for guild_id, stream in sessions.controller.streams.items()},
+            METRICS_HOST,
+            METRICS_PORT,
+        )
@@ -1,9 +1,31 @@
 from dskek.discord_bot import bot
-from dskek.env import YT_PROXY, FFMPEG_PROXY
+from dskek.env import (
+    YT_PROXY,
+    FFMPEG_PROXY,
+    YT_CACHE_PATH,
+    YT_CACHE_SIZE,
+    MUSIC_PREFETCH_DEPTH,
+    MUSIC_MAX_EXTRACTIONS,
+    MUSIC_VOLUME,
+    MUSIC_OPUS_PASSTHROUGH,
+    MEDIA_CACHE_DIR,
+    MEDIA_CACHE_MAX_MB,
+    MEDIA_CACHE_MIN_PLAYS,
+    YTDL_WORKERS,
+    YTDL_WORKER_PROCESSES,
+)
+from dskek.extractor import ExtractionPool
+from dskek.ytcache import ExtractionCache
+from dskek.mediacache import DOWNLOAD_SLOTS, MediaCache
+from dskek.music import GuildPlayer, Playlist, Track
+from typing import AsyncIterator
+from urllib.parse import parse_qs, urlsplit
 import logging
 import yt_dlp
+import culsans
 import discord
 import asyncio
+import threading
 from discord.ext.commands import Context
 import traceback
 
@@ -33,33 +55,175 @@ if YT_PROXY:
     ytdl_format_options['proxy'] = YT_PROXY
 
 ffmpeg_options = {
+    # prefetched tracks open their stream early; let ffmpeg reconnect if it idles out
+    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
     'options': '-vn',
 }
 
 if FFMPEG_PROXY:
     logger.info(f"Using ffmpeg proxy: {FFMPEG_PROXY}")
-    ffmpeg_options['before_options'] = f'-http_proxy "{FFMPEG_PROXY}"'
+    ffmpeg_options['before_options'] += f' -http_proxy "{FFMPEG_PROXY}"'
 
 
+# only used for prepare_filename; extraction runs on the pool's own instances
 ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+# lists playlist entries page by page without resolving any of them
+flat_ytdl_options = {
+    **ytdl_format_options,
+    'noplaylist': False,
+    'extract_flat': 'in_playlist',
+    'lazy_playlist': True,
+}
+# listed entries waiting to be queued; the listing thread blocks beyond this
+PLAYLIST_BUFFER = 20
+
+# large parts of an info dict that playback never looks at
+UNCACHED_KEYS = ("formats", "thumbnails", "automatic_captions", "subtitles", "heatmap")
+
+# built in setup_hook: spawned extraction workers must not open pools or caches
+extraction_pool: ExtractionPool
+extractions: ExtractionCache
+media: MediaCache
+
+
+async def start_youtube():
+    global extraction_pool, extractions, media
+    extraction_pool = ExtractionPool(
+        ytdl_format_options, YTDL_WORKERS, YTDL_WORKER_PROCESSES, download_workers=DOWNLOAD_SLOTS
+    )
+    bot.shutdown_callbacks.append(extraction_pool.shutdown)
+    extractions = ExtractionCache(YT_CACHE_PATH, YT_CACHE_SIZE)
+    bot.shutdown_callbacks.append(extractions.flush)
+    # cache fills use the pool's download lane, never the guilds' extraction workers
+    media = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_MB << 20, MEDIA_CACHE_MIN_PLAYS, extraction_pool.download)
+
+
+bot.startup_callbacks.append(start_youtube)
+
+
+def is_playlist(url: str) -> bool:
+    parts = urlsplit(url)
+    return parts.scheme in ('http', 'https') and (
+        'list' in parse_qs(parts.query) or parts.path.rstrip('/').endswith('/playlist')
+    )
+
+
+async def open_playlist(url: str, requested_by: str) -> Playlist | None:
+    """Start listing a playlist on its own thread; None if the URL is a single video.
+
+    The thread keeps its own YoutubeDL because the lazy entry iterator it
+    walks belongs to the instance that created it."""
+    stop = threading.Event()
+    buffer = culsans.Queue(PLAYLIST_BUFFER)
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.sync_q.put(item, timeout=1)
+                return True
+            except culsans.QueueFull:
+                pass
+        return False
+
+    def produce():
+        try:
+            flat_ytdl = yt_dlp.YoutubeDL(flat_ytdl_options)
+            info = flat_ytdl.extract_info(url, download=False, process=False)
+            # watch?v=...&list=... redirects to the playlist page
+            for _ in range(3):
+                if info.get('_type') not in ('url', 'url_transparent'):
+                    break
+                info = flat_ytdl.extract_info(info['url'], download=False, process=False)
+            if info.get('_type') != 'playlist':
+                put(None)
+                return
+            if not put(info.get('title') or url):
+                return
+            for entry in info['entries']:
+                if not put(entry):
+                    return
+        except Exception as e:
+            logger.error(f"Playlist listing failed: {e}")
+            put(e)
+        put(None)
+
+    async def entries() -> AsyncIterator[Track]:
+        try:
+            while isinstance(entry := await buffer.async_q.get(), dict):
+                if url := entry.get('url') or entry.get('webpage_url'):
+                    yield Track(url, requested_by, title=entry.get('title'))
+        finally:
+            stop.set()
+
+    threading.Thread(target=produce, name='playlist-lister', daemon=True).start()
+    title = await buffer.async_q.get()
+    if isinstance(title, Exception):
+        raise title
+    if title is None:
+        return None
+    return Playlist(title, requested_by, entries(), stop)
+
+
+async def extract_cached(url: str, guild_id: int | None = None) -> dict:
+    async def fetch():
+        data = await extraction_pool.extract(url, guild_id=guild_id)
+        return {key: value for key, value in data.items() if key not in UNCACHED_KEYS}
+
+    return await extractions.get(url, fetch)
 
 
 class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5):
+    def __init__(self, source, *, data, volume=MUSIC_VOLUME):
         super().__init__(source, volume)
         self.data = data
         self.title = data.get('title')
         self.url = data.get('url')
 
     @classmethod
-    async def from_url(cls, url: str, *, loop=None, stream=True):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
-        if 'entries' in data:
-            data = data['entries'][0]
+    async def from_url(cls, url: str, *, stream=True, guild_id: int | None = None) -> discord.AudioSource:
+        if stream:
+            data = await extract_cached(url, guild_id)
+        else:
+            # downloads go to disk, so only the stream URLs are worth caching
+            data = await extraction_pool.extract(url, guild_id=guild_id, download=True)
         filename = data['url'] if stream else ytdl.prepare_filename(data)
+        local = not stream
+        if stream and (cached := await media.lookup(data)):
+            # repeat track: play the ogg/opus copy instead of going through the proxy
+            filename, local = cached, True
+            data = {**data, 'acodec': 'opus'}
 
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
+        if MUSIC_OPUS_PASSTHROUGH:
+            return YTDLOpusSource(filename, data=data, local=local)
+        options = {'options': ffmpeg_options['options']} if local else ffmpeg_options
+        return cls(discord.FFmpegPCMAudio(filename, **options), data=data)
+
+
+class YTDLOpusSource(discord.FFmpegOpusAudio):
+    """ffmpeg produces the Opus packets, so python neither scales PCM nor
+    encodes. Opus input at unity volume (youtube's usual bestaudio) is
+    remuxed with codec copy; anything else is encoded once by ffmpeg, with
+    the volume applied as an ffmpeg filter."""
+
+    def __init__(self, source: str, *, data: dict, volume: float = MUSIC_VOLUME, local: bool = False):
+        self.data = data
+        self.title = data.get('title')
+        self.url = data.get('url')
+        self.volume = volume
+        options = ffmpeg_options['options']
+        copy = data.get('acodec') == 'opus' and volume == 1
+        if volume != 1:
+            options += f' -filter:a volume={volume}'
+        super().__init__(
+            source,
+            # discord.py maps 'opus'/'libopus' to copy; None means encode with libopus
+            codec='copy' if copy else None,
+            # what yt-dlp reports is the probe; no extra ffprobe round trip
+            bitrate=round(data.get('abr') or 128),
+            # reconnect and proxy flags are for http inputs only
+            before_options=None if local else ffmpeg_options['before_options'],
+            options=options,
+        )
 
 
 @bot.command(name='yt', help='Tells the bot to join the voice channel')
@@ -72,9 +236,34 @@ async def join(ctx: Context):
     await channel.connect()
 
 
+players: dict[int, GuildPlayer] = {}
+
+
+def get_player(guild_id: int) -> GuildPlayer:
+    if guild_id not in players:
+        players[guild_id] = GuildPlayer(
+            lambda query: YTDLSource.from_url(query, stream=True, guild_id=guild_id),
+            prefetch_depth=MUSIC_PREFETCH_DEPTH,
+            max_extractions=MUSIC_MAX_EXTRACTIONS,
+            # plays count once a track starts, not when it's prefetched
+            on_play=lambda source: media.played(source.data),
+        )
+    return players[guild_id]
+
+
+@bot.listen("on_voice_state_update")
+async def on_music_voice_state(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    # !leave, kicks and disconnects all end the queue
+    if member == bot.user and after.channel is None:
+        if player := players.pop(member.guild.id, None):
+            player.stop()
+
+
 @bot.command(name='leave', help='To make the bot leave the voice channel')
 async def leave(ctx: Context):
     voice_client = ctx.message.guild.voice_client
+    if player := players.pop(ctx.guild.id, None):
+        player.stop()
     if voice_client is not None and voice_client.is_connected():
         await voice_client.disconnect()
     else:
@@ -82,19 +271,61 @@ async def leave(ctx: Context):
 
 
 @bot.command(name='play', help='To play song')
-async def play(ctx: Context, url: str):
+async def play(ctx: Context, *, url: str):
     try:
         server = ctx.message.guild
         if server.voice_client is None:
             await join(ctx)
         voice_channel = server.voice_client
+        if voice_channel is None:
+            return
 
-        async with ctx.typing():
-            player = await YTDLSource.from_url(url, loop=bot.loop, stream=True)
-            voice_channel.play(player, after=lambda e: print(
-                'Player error: %s' % e) if e else None)
-
-        await ctx.send('**Now playing:** {}'.format(player.title))
+        player = get_player(server.id)
+        if voice_channel.is_playing() and not player.active:
+            await ctx.send("I'm busy in this voice channel, `!leave` first.")
+            return
+        item = Track(url, ctx.author.display_name)
+        if is_playlist(url) and (playlist := await open_playlist(url, ctx.author.display_name)):
+            item = playlist
+            await ctx.send(f'**Queued playlist:** {item.title}')
+        position = player.enqueue(voice_channel, ctx.channel, item)
+        if position:
+            await ctx.send(f'**Queued #{position}:** {item}')
     except Exception as e:
         logger.error(f"An error occurred: {e}\n{traceback.format_exc()}")
         await ctx.send(f'An error occurred: {e}')
+
+
+@bot.command(name='skip', help='Skip the current song')
+async def skip(ctx: Context):
+    player = players.get(ctx.guild.id)
+    if player is None or not player.skip():
+        await ctx.send("Nothing is playing.")
+
+
+@bot.command(name='queue', help='Show the upcoming songs')
+async def queue(ctx: Context):
+    player = players.get(ctx.guild.id)
+    if player is None or not (player.current or player.upcoming):
+        await ctx.send("The queue is empty.")
+        return
+    lines = []
+    if player.current:
+        lines.append(f"**Now playing:** {player.current} (requested by {player.current.requested_by})")
+    for position, track in enumerate(player.upcoming, start=1):
+        lines.append(f"{position}. {track} (requested by {track.requested_by})")
+    await ctx.send("\n".join(lines)[:2000])
+
+
+@bot.command(name='clear', help='Remove all upcoming songs')
+async def clear(ctx: Context):
+    player = players.get(ctx.guild.id)
+    count = player.clear() if player else 0
+    await ctx.send(f"Removed {count} song(s) from the queue.")
+
+
+@bot.command(name='cache', help='yt-dlp extraction pool and cache statistics')
+async def cache_stats(ctx: Context):
+    await ctx.send(
+        f"```\n{extractions.summary()}\n{await asyncio.to_thread(media.summary)}\nextraction pool: {extraction_pool.summary()}\n```"
+    )
@@ -0,0 +1,237 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger("discord")
+
+# used when the stream URL carries no expiry of its own
+DEFAULT_TTL = 1_800
+MAX_TTL = 6 * 3_600
+# stop handing out a signed URL this long before it actually expires
+EXPIRY_MARGIN = 120
+TRACKING_PARAMS = {"si", "feature", "pp", "ab_channel", "fbclid", "gclid"}
+# last_used updates are written in batches of this many, or this often
+TOUCH_BATCH = 32
+TOUCH_INTERVAL = 60
+
+
+def normalize_query(query: str) -> str:
+    """Cache key for a !play argument: canonical URL or case-folded search."""
+    query = query.strip()
+    parts = urlsplit(query)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return "search:" + " ".join(query.casefold().split())
+    host = parts.netloc.lower().removeprefix("www.").removeprefix("m.").removeprefix("music.")
+    params = [
+        (k, v)
+        for k, v in parse_qsl(parts.query)
+        if k not in TRACKING_PARAMS and not k.startswith("utm_")
+    ]
+    if host == "youtu.be":
+        return f"youtube:{parts.path.strip('/')}"
+    if host == "youtube.com":
+        if video := dict(params).get("v"):
+            return f"youtube:{video}"
+        if parts.path.startswith("/shorts/"):
+            return f"youtube:{parts.path.removeprefix('/shorts/').strip('/')}"
+    return urlunsplit(("https", host, parts.path.rstrip("/"), urlencode(sorted(params)), ""))
+
+
+def stream_expiry(data: dict) -> float | None:
+    """Unix time at which the signed stream URL stops working, if it says."""
+    query = dict(parse_qsl(urlsplit(data.get("url") or "").query))
+    for name in ("expire", "expires", "Expires"):
+        if (value := query.get(name)) and value.isdigit():
+            return float(value)
+    return None
+
+
+class ExtractionCache:
+    """LRU of yt-dlp extraction results, kept in memory and mirrored to SQLite.
+
+    Entries expire with the signed stream URL they contain. Concurrent
+    lookups of the same key share one extraction. SQLite is only touched
+    from worker threads; hits queue their last_used update and those are
+    written in batches.
+    """
+
+    def __init__(self, path: str | None, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._memory: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self._touched: dict[str, float] = {}
+        self._touched_since = time.monotonic()
+        self._flushing: asyncio.Task | None = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.executescript(
+                    """
+                    PRAGMA journal_mode=WAL;
+                    PRAGMA synchronous=NORMAL;
+                    CREATE TABLE IF NOT EXISTS extractions (
+                        key TEXT PRIMARY KEY,
+                        data TEXT NOT NULL,
+                        expires REAL NOT NULL,
+                        last_used REAL NOT NULL
+                    );
+                    """
+                )
+                self._db.execute("DELETE FROM extractions WHERE expires < ?", (time.time(),))
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Extraction cache at {path} is unusable, keeping it in memory: {e}")
+                self._db = None
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    async def get(self, query: str, fetch: Callable[[], Awaitable[dict]]) -> dict:
+        key = normalize_query(query)
+        if (data := self._lookup(key)) is not None:
+            return data
+        if key not in self._inflight and (data := await self._load(key)) is not None:
+            return data
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.create_task(self._extract(key, fetch))
+        else:
+            self.coalesced += 1
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # one caller giving up must not cancel the extraction for the others
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                if not task.done():
+                    # ...but once everyone has, don't keep a worker busy for nobody
+                    task.cancel()
+
+    async def _extract(self, key: str, fetch: Callable[[], Awaitable[dict]]) -> dict:
+        try:
+            data = await fetch()
+            await self._store(key, data)
+            return data
+        finally:
+            self._inflight.pop(key, None)
+
+    def _lookup(self, key: str) -> dict | None:
+        now = time.time()
+        if entry := self._memory.get(key):
+            expires, data = entry
+            if expires > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self._touch(key, now)
+                return data
+            del self._memory[key]
+        return None
+
+    async def _load(self, key: str) -> dict | None:
+        if self._db is None:
+            return None
+        now = time.time()
+        row = await asyncio.to_thread(self._read, key, now)
+        if row is None:
+            return None
+        data, expires = json.loads(row[0]), row[1]
+        self._remember(key, expires, data)
+        self.disk_hits += 1
+        self._touch(key, now)
+        return data
+
+    def _read(self, key: str, now: float) -> tuple[str, float] | None:
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT data, expires FROM extractions WHERE key = ? AND expires > ?", (key, now)
+            ).fetchone()
+
+    def _touch(self, key: str, now: float):
+        if self._db is None:
+            return
+        if not self._touched:
+            self._touched_since = time.monotonic()
+        self._touched[key] = now
+        if self._flushing is None and (
+            len(self._touched) >= TOUCH_BATCH or time.monotonic() - self._touched_since >= TOUCH_INTERVAL
+        ):
+            self._flushing = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        """Write the queued last_used updates."""
+        try:
+            if self._touched:
+                touched, self._touched = self._touched, {}
+                await asyncio.to_thread(self._write, touched)
+        except sqlite3.Error as e:
+            logger.warning(f"Couldn't update the extraction cache: {e}")
+        finally:
+            self._flushing = None
+
+    def _write(self, touched: dict[str, float], row: tuple | None = None):
+        with self._db_lock:
+            if touched:
+                self._db.executemany(
+                    "UPDATE extractions SET last_used = ? WHERE key = ?",
+                    [(now, key) for key, now in touched.items()],
+                )
+            if row is not None:
+                self._db.execute("INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?)", row)
+                self._db.execute(
+                    "DELETE FROM extractions WHERE expires < ? OR key NOT IN "
+                    "(SELECT key FROM extractions ORDER BY last_used DESC LIMIT ?)",
+                    (row[3], self.max_entries),
+                )
+            self._db.commit()
+
+    async def _store(self, key: str, data: dict):
+        now = time.time()
+        expires = stream_expiry(data)
+        expires = min(expires - EXPIRY_MARGIN, now + MAX_TTL) if expires else now + DEFAULT_TTL
+        if expires <= now:
+            return
+        self._remember(key, expires, data)
+        if self._db is None:
+            return
+        try:
+            payload = json.dumps(data)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Not persisting extraction for {key}: {e}")
+            return
+        # queued hits go out with the insert, so the LRU trim sees them
+        touched, self._touched = self._touched, {}
+        try:
+            await asyncio.to_thread(self._write, touched, (key, payload, expires, now))
+        except sqlite3.Error as e:
+            logger.warning(f"Not persisting extraction for {key}: {e}")
+
+    def _remember(self, key: str, expires: float, data: dict):
+        self._memory[key] = (expires, data)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def summary(self) -> str:
+        return (
+            f"entries={len(self._memory)} hits={self.hits} disk_hits={self.disk_hits} "
+            f"misses={self.misses} coalesced={self.coalesced} evictions={self.evictions}"
+        )
@@ -1,8 +1,7 @@
-from dskek.env import DISCORD_BOT_TOKEN
-from dskek.discord_bot import bot, main
-import dskek.voicebot
-import dskek.youtube
-
-
 if __name__ == "__main__":
+    # spawned extraction workers run this file as __mp_main__, so the bot is only loaded here
+    from dskek.discord_bot import main
+    import dskek.voicebot
+    import dskek.youtube
+
     main()
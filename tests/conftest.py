@@ -0,0 +1,4 @@
+import os
+
+# dskek.gemini builds its client at import time
+os.environ.setdefault("GEMINI_API_KEY", "test")
@@ -0,0 +1,52 @@
+from dskek.channels import AudioQueue, OverflowPolicy, PCMRingBuffer
+from dskek.converters import AudioData, AudioType
+from dskek.models import SpeechEvent
+
+
+FRAME = 3840
+
+
+def test_underruns_count_gaps_during_a_response():
+    ring = PCMRingBuffer(10 * FRAME, FRAME)
+    # idle: nothing expected, nothing counted
+    for _ in range(50):
+        ring.read_frame()
+    assert ring.underruns == 0
+
+    ring.write(bytes(FRAME * 2 + FRAME // 2))
+    ring.read_frame(expecting=True)
+    ring.read_frame(expecting=True)
+    # the partial frame and the empty ones after it are one gap
+    for _ in range(5):
+        ring.read_frame(expecting=True)
+    assert ring.underruns == 1
+
+    ring.write(bytes(FRAME))
+    ring.read_frame(expecting=True)
+    # the response is over: running dry is just its end
+    ring.read_frame(expecting=False)
+    ring.read_frame(expecting=True)
+    assert ring.underruns == 1
+
+
+def test_drop_oldest_keeps_the_newest_audio_and_control_items():
+    chunk = bytes(20 * AudioType.GEMINI_SEND.value.bytes_per_ms)
+    queue = AudioQueue(100, OverflowPolicy.DROP_OLDEST)
+    queue.offer(SpeechEvent.START)
+    for value in range(8):
+        assert queue.offer(AudioData(bytes([value]) + chunk[1:], AudioType.GEMINI_SEND))
+    items = []
+    while not queue.sync_q.empty():
+        items.append(queue.sync_q.get_nowait())
+    assert items[0] is SpeechEvent.START
+    assert [item.data[0] for item in items[1:]] == [3, 4, 5, 6, 7]
+    assert (queue.dropped, queue.dropped_ms) == (3, 60)
+
+
+def test_drop_newest_refuses_what_does_not_fit():
+    chunk = bytes(20 * AudioType.GEMINI_SEND.value.bytes_per_ms)
+    queue = AudioQueue(40, OverflowPolicy.DROP_NEWEST)
+    assert queue.offer(AudioData(chunk, AudioType.GEMINI_SEND))
+    assert queue.offer(AudioData(chunk, AudioType.GEMINI_SEND))
+    assert not queue.offer(AudioData(chunk, AudioType.GEMINI_SEND))
+    assert queue.dropped_ms == 20
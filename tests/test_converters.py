@@ -0,0 +1,40 @@
+import itertools
+import numpy as np
+import pytest
+from dskek.converters import AudioType, FramePool, Resampler, convert_pcm
+
+
+@pytest.mark.parametrize("from_type,to_type", list(itertools.product(AudioType, repeat=2)))
+@pytest.mark.parametrize("seed", range(5))
+def test_chunked_resampling_matches_whole(from_type, to_type, seed):
+    rng = np.random.default_rng(seed)
+    info = from_type.value
+    samples = int(rng.integers(1, 5_000))
+    pcm = rng.integers(-32768, 32768, samples * info.channels, dtype=np.int16).tobytes()
+    # random split points in whole samples, empty chunks included
+    cuts = np.sort(rng.integers(0, samples + 1, int(rng.integers(0, 12)))) * info.frame_size
+    resampler = Resampler(from_type, to_type)
+    chunked = b"".join(
+        resampler.process(pcm[start:end]) for start, end in zip([0, *cuts], [*cuts, len(pcm)])
+    )
+    assert chunked + resampler.flush() == convert_pcm(pcm, info, to_type.value)
+
+
+def test_released_frames_are_reused_and_cleared():
+    pool = FramePool(AudioType.GEMINI_SEND, max_free=2)
+    frame = pool.get()
+    frame.opus = b"packet"
+    # what a decoder does: write into the buffer, then size the view
+    frame.buffer[:10] = bytes(range(10))
+    frame.set_length(10)
+    frame.release()
+    again = pool.get()
+    assert again is frame
+    assert again.opus is None and again.data == b""
+    again.release()
+    # a backlog allocates, but only max_free frames are parked afterwards
+    frames = [pool.get() for _ in range(5)]
+    for frame in frames:
+        frame.release()
+    assert pool.allocated == 5
+    assert len(pool) == 2
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+from dskek import extractor
+from dskek.extractor import ExtractionPool
+
+
+def test_guilds_are_served_round_robin(monkeypatch):
+    order = []
+    release = threading.Event()
+
+    def extract(url, download, directory=None):
+        if url == "busy":
+            release.wait()
+        order.append(url)
+        return {"url": url}
+
+    monkeypatch.setattr(extractor, "extract", extract)
+
+    async def run():
+        pool = ExtractionPool({}, workers=1)
+        busy = asyncio.ensure_future(pool.extract("busy", guild_id=0))
+        await asyncio.sleep(0)
+        jobs = [asyncio.ensure_future(pool.extract(f"a{i}", guild_id=1)) for i in range(3)]
+        jobs.append(asyncio.ensure_future(pool.extract("b0", guild_id=2)))
+        await asyncio.sleep(0)
+        assert pool.queued == 4
+        release.set()
+        await asyncio.gather(busy, *jobs)
+        await pool.shutdown()
+
+    asyncio.run(run())
+    assert order == ["busy", "a0", "b0", "a1", "a2"]
+
+
+def test_downloads_do_not_hold_extraction_workers(monkeypatch):
+    release = threading.Event()
+
+    def extract(url, download, directory=None):
+        if download:
+            release.wait()
+            return {"filepath": f"{directory}/{url}"}
+        return {"url": url}
+
+    monkeypatch.setattr(extractor, "extract", extract)
+
+    async def run():
+        pool = ExtractionPool({}, workers=1)
+        download = asyncio.ensure_future(pool.download("slow", "/tmp"))
+        await asyncio.sleep(0)
+        assert pool.downloading == 1
+        # the only extraction worker is still free
+        assert await asyncio.wait_for(pool.extract("fast", guild_id=1), 5) == {"url": "fast"}
+        release.set()
+        assert await download == "/tmp/slow"
+        assert pool.downloading == 0
+        await pool.shutdown()
+
+    asyncio.run(run())
+
+
+def test_cancelled_jobs_are_skipped(monkeypatch):
+    ran = []
+    release = threading.Event()
+
+    def extract(url, download, directory=None):
+        if url == "busy":
+            release.wait()
+        ran.append(url)
+        return {"url": url}
+
+    monkeypatch.setattr(extractor, "extract", extract)
+
+    async def run():
+        pool = ExtractionPool({}, workers=1)
+        busy = asyncio.ensure_future(pool.extract("busy"))
+        await asyncio.sleep(0)
+        gone = asyncio.ensure_future(pool.extract("gone"))
+        kept = asyncio.ensure_future(pool.extract("kept"))
+        await asyncio.sleep(0)
+        gone.cancel()
+        release.set()
+        await asyncio.gather(busy, kept)
+        await pool.shutdown()
+        assert pool.cancelled == 1
+
+    asyncio.run(run())
+    assert ran == ["busy", "kept"]
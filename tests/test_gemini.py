@@ -0,0 +1,188 @@
+import asyncio
+import pytest
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from dskek import gemini
+from dskek.channels import Stream
+from dskek.converters import AudioData, AudioType
+from dskek.gemini import AudioLoop
+from dskek.models import SpeechEvent
+
+
+CHUNK_MS = 20
+
+
+@pytest.mark.parametrize("transport", ["queue", "ring"])
+def test_replay_buffer_is_bounded(transport):
+    async def run():
+        stream = Stream(transport=transport)
+        loop = AudioLoop(stream, replay_ms=300)
+        chunk = bytes(CHUNK_MS * AudioType.GEMINI_SEND.value.bytes_per_ms)
+        for _ in range(50):
+            stream.put_in(AudioData(chunk, AudioType.GEMINI_SEND))
+        stream.put_in(SpeechEvent.END)
+        await loop._buffer_input(0.05)
+        return loop
+
+    loop = asyncio.run(run())
+    audio = [item for item in loop._replay if item is not SpeechEvent.END]
+    assert loop._replay_ms == 300
+    assert sum(len(item) for item in audio) == 300 * AudioType.GEMINI_SEND.value.bytes_per_ms
+    assert loop.replay_dropped_ms == 700
+    assert loop._replay[-1] is SpeechEvent.END
+
+
+class Done(Exception):
+    pass
+
+
+def response(data: bytes | None = None, *, interrupted=False, turn_complete=False):
+    content = SimpleNamespace(interrupted=interrupted, turn_complete=turn_complete)
+    return SimpleNamespace(
+        server_content=content, data=data, text=None, session_resumption_update=None, go_away=None
+    )
+
+
+class ScriptedSession:
+    """Hands out one turn, runs `between(index)` before each of its messages."""
+
+    def __init__(self, turn: list, between):
+        self.turn = turn
+        self.between = between
+        self.calls = 0
+
+    def receive(self):
+        self.calls += 1
+        if self.calls > 1:
+            raise Done
+        return self._messages()
+
+    async def _messages(self):
+        for index, message in enumerate(self.turn):
+            self.between(index)
+            yield message
+
+
+def test_talking_over_a_response_drops_the_rest_of_it():
+    chunk = bytes(100 * AudioType.GEMINI_RECEIVE.value.bytes_per_ms)
+
+    async def run():
+        stream = Stream()
+        loop = AudioLoop(stream)
+        # VoiceBot._push interrupts from the receive worker after the second chunk
+        loop.session = ScriptedSession(
+            [response(chunk), response(chunk), response(chunk), response(chunk, turn_complete=True)],
+            lambda index: index == 2 and stream.interrupt(),
+        )
+        with pytest.raises(Done):
+            await loop.receive_audio()
+        return stream, loop
+
+    stream, loop = asyncio.run(run())
+    assert stream.discarded_ms == 200
+    assert not loop.responding
+    assert not loop._discarding
+
+
+def test_a_cancelled_batch_is_kept_for_replay():
+    chunk = bytes(CHUNK_MS * AudioType.GEMINI_SEND.value.bytes_per_ms)
+
+    async def run():
+        stream = Stream()
+        loop = AudioLoop(stream, batch_ms=1_000, max_wait_ms=10_000)
+        for value in (1, 2):
+            stream.put_in(AudioData(bytes([value]) * len(chunk), AudioType.GEMINI_SEND))
+        first = await loop._next_message()
+        batch = asyncio.ensure_future(loop._collect_batch(first))
+        await asyncio.sleep(0.01)
+        # the second frame is already dequeued when the sender is cancelled
+        batch.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await batch
+        return loop
+
+    loop = asyncio.run(run())
+    assert list(loop._replay) == [bytes([1]) * len(chunk) + bytes([2]) * len(chunk)]
+    assert loop._replay_ms == 2 * CHUNK_MS
+
+
+class FlakySession:
+    """Hands out a resumption handle, then fails the first audio send."""
+
+    def __init__(self, fail: bool):
+        self.fail = fail
+        self.sent: list = []
+
+    async def send_realtime_input(self, audio=None, audio_stream_end=None, text=None):
+        if self.fail:
+            await asyncio.sleep(0.01)
+            raise ConnectionError("socket closed")
+        self.sent.append(audio["data"] if audio is not None else SpeechEvent.END if audio_stream_end else text)
+
+    def receive(self):
+        return self._messages()
+
+    async def _messages(self):
+        update = SimpleNamespace(resumable=True, new_handle="handle")
+        yield SimpleNamespace(
+            server_content=None, data=None, text=None, session_resumption_update=update, go_away=None
+        )
+        await asyncio.Event().wait()
+
+
+def test_a_dropped_session_resumes_and_replays_its_input(monkeypatch):
+    monkeypatch.setattr(gemini, "RECONNECT_BASE_DELAY", 0.01)
+    chunk = bytes(range(256)) * (CHUNK_MS * AudioType.GEMINI_SEND.value.bytes_per_ms // 256)
+    sessions = [FlakySession(fail=True), FlakySession(fail=False)]
+    handles = []
+
+    @asynccontextmanager
+    async def connect():
+        yield sessions[0]
+
+    @asynccontextmanager
+    async def resume(handle):
+        handles.append(handle)
+        yield sessions[1]
+
+    async def run():
+        stream = Stream()
+        loop = AudioLoop(stream, connect=connect, resume=resume)
+        stream.put_in(AudioData(chunk, AudioType.GEMINI_SEND))
+        stream.put_in(SpeechEvent.END)
+        task = asyncio.create_task(loop.run())
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if SpeechEvent.END in sessions[1].sent:
+                break
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return loop
+
+    loop = asyncio.run(run())
+    assert handles == ["handle"]
+    assert loop.reconnects == 1
+    audio = b"".join(item for item in sessions[1].sent if isinstance(item, bytes))
+    assert audio == chunk
+    assert sessions[1].sent[-1] is SpeechEvent.END
+
+
+def test_frames_are_batched_up_to_the_batch_size():
+    chunk = bytes(CHUNK_MS * AudioType.GEMINI_SEND.value.bytes_per_ms)
+
+    async def run():
+        stream = Stream()
+        loop = AudioLoop(stream, batch_ms=60, max_wait_ms=10)
+        for _ in range(4):
+            stream.put_in(AudioData(chunk, AudioType.GEMINI_SEND))
+        stream.put_in(SpeechEvent.END)
+        first = await loop._collect_batch(await loop._next_message())
+        # the END marker stops the second batch short and waits its turn
+        second = await loop._collect_batch(await loop._next_message())
+        return first, second, await loop._next_message()
+
+    first, second, after = asyncio.run(run())
+    assert len(first) == 3 * len(chunk)
+    assert len(second) == len(chunk)
+    assert after is SpeechEvent.END
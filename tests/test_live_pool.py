@@ -0,0 +1,87 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dskek import live_pool
+from dskek.live_pool import LiveSessionPool
+
+
+class FakeLive:
+    def __init__(self):
+        self.opened = 0
+        self.open = 0
+
+    @asynccontextmanager
+    async def connect(self):
+        self.opened += 1
+        self.open += 1
+        try:
+            yield object()
+        finally:
+            self.open -= 1
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_the_pool_warms_up_on_first_use(monkeypatch):
+    async def run():
+        live = FakeLive()
+        pool = LiveSessionPool(live.connect, 2)
+        await settle()
+        # nothing connects before the first join
+        assert live.opened == 0
+        async with pool.connect():
+            await settle()
+            assert pool.misses == 1
+            assert len(pool) == 2
+        async with pool.connect():
+            assert pool.hits == 1
+        await pool.close()
+        await settle()
+        assert live.open == 0
+
+    asyncio.run(run())
+
+
+def test_warm_sessions_count_against_the_limit():
+    async def run():
+        live = FakeLive()
+        in_use = 0
+        pool = LiveSessionPool(live.connect, 3, spare=lambda: 3 - in_use)
+        in_use = 1
+        async with pool.connect():
+            await settle()
+            # one in use leaves room for two warm ones
+            assert len(pool) == 2
+            assert live.open == 3
+            in_use = 2
+            async with pool.connect():
+                await settle()
+                assert pool.hits == 1
+                # the one handed out isn't replaced: no room
+                assert len(pool) == 1
+                assert live.open == 3
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_an_unused_pool_empties_and_stops_reconnecting(monkeypatch):
+    monkeypatch.setattr(live_pool, "POOL_CHECK_INTERVAL", 0.01)
+
+    async def run():
+        live = FakeLive()
+        pool = LiveSessionPool(live.connect, 1, max_idle=0.02, idle_after=0.1)
+        async with pool.connect():
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.2)
+        assert len(pool) == 0
+        assert live.open == 0
+        assert pool._maintainer is None
+        opened = live.opened
+        await asyncio.sleep(0.1)
+        assert live.opened == opened
+        await pool.close()
+
+    asyncio.run(run())
@@ -0,0 +1,101 @@
+import asyncio
+import os
+import time
+from dskek import mediacache
+from dskek.mediacache import MediaCache, file_digest
+
+
+def track(video_id: str) -> dict:
+    return {"id": video_id, "extractor_key": "Youtube", "webpage_url": f"https://youtu.be/{video_id}", "duration": 60}
+
+
+def fake_convert(cache: MediaCache, size: int):
+    def convert(key, data, downloaded, tmp):
+        final = os.path.join(cache.directory, f"{key}.ogg")
+        with open(final, "wb") as f:
+            f.write(os.urandom(size))
+        return final, size, file_digest(final)
+
+    return convert
+
+
+async def no_download(url, directory):
+    return os.path.join(directory, "audio.webm")
+
+
+async def settle(cache: MediaCache):
+    while cache._counting or cache._downloads:
+        await asyncio.gather(*cache._counting, *cache._downloads.values())
+
+
+def test_plays_are_counted_when_tracks_start(tmp_path):
+    async def run():
+        cache = MediaCache(str(tmp_path), 1 << 20, 2, no_download)
+        cache._convert = fake_convert(cache, 1000)
+        data = track("a")
+        # resolving alone (prefetch) counts nothing
+        assert await cache.lookup(data) is None
+        assert await cache.lookup(data) is None
+        assert not cache._downloads
+        cache.played(data)
+        await settle(cache)
+        assert cache.downloaded == 0
+        cache.played(data)
+        await settle(cache)
+        assert cache.downloaded == 1
+        assert await cache.lookup(data) == os.path.join(str(tmp_path), "Youtube-a.ogg")
+        assert cache.hits == 1
+
+    asyncio.run(run())
+
+
+def test_eviction_keeps_the_files_that_fit(tmp_path):
+    async def run():
+        cache = MediaCache(str(tmp_path), 2500, 1, no_download)
+        for video_id, size in (("small", 400), ("big", 2000), ("new", 1000)):
+            cache._convert = fake_convert(cache, size)
+            cache.played(track(video_id))
+            await settle(cache)
+            # distinct last_used for the LRU order
+            time.sleep(0.01)
+        return cache
+
+    cache = asyncio.run(run())
+    kept = {key for (key,) in cache._execute("SELECT key FROM media WHERE path IS NOT NULL")}
+    # "big" no longer fits behind "new"; the older "small" still does
+    assert kept == {"Youtube-new", "Youtube-small"}
+    assert cache.evicted == 1
+    assert not os.path.exists(os.path.join(str(tmp_path), "Youtube-big.ogg"))
+
+
+def test_corrupt_files_are_dropped(tmp_path):
+    async def run():
+        cache = MediaCache(str(tmp_path), 1 << 20, 1, no_download)
+        cache._convert = fake_convert(cache, 1000)
+        data = track("a")
+        cache.played(data)
+        await settle(cache)
+        path = await cache.lookup(data)
+        # a fresh process verifies the digest before serving
+        cache = MediaCache(str(tmp_path), 1 << 20, 1, no_download)
+        with open(path, "r+b") as f:
+            f.write(b"garbage")
+        assert await cache.lookup(data) is None
+        assert not os.path.exists(path)
+
+    asyncio.run(run())
+
+
+def test_leftovers_and_stale_play_counts_are_cleaned(tmp_path, monkeypatch):
+    async def run():
+        cache = MediaCache(str(tmp_path), 1 << 20, 5, no_download)
+        cache.played(track("once"))
+        await settle(cache)
+
+    asyncio.run(run())
+    os.mkdir(tmp_path / f"{mediacache.DOWNLOAD_PREFIX}x")
+    (tmp_path / "stray.ogg").write_bytes(b"x")
+    monkeypatch.setattr(mediacache, "PLAY_HISTORY_TTL", -1)
+    cache = MediaCache(str(tmp_path), 1 << 20, 5, no_download)
+    assert cache._execute("SELECT COUNT(*) FROM media") == [(0,)]
+    assert sorted(os.listdir(tmp_path)) == ["index.sqlite3", "index.sqlite3-shm", "index.sqlite3-wal"]
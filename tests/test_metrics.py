@@ -0,0 +1,10 @@
+from dskek.channels import Stream
+from dskek.metrics import render_prometheus
+
+
+def test_ring_levels_are_gauges():
+    text = render_prometheus({1: Stream(transport="ring").metrics})
+    for name in ("in_ring_fill_ms", "in_ring_high_water_ms", "out_ring_fill_ms", "out_ring_high_water_ms"):
+        assert f"# TYPE dskek_{name} gauge" in text
+    assert "# TYPE dskek_in_ring_wakeups counter" in text
+    assert 'dskek_out_ring_fill_ms{guild="1"} 0' in text
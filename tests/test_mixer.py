@@ -0,0 +1,53 @@
+import numpy as np
+from dskek.converters import AudioType
+from dskek.mixer import RTP_FRAME_SAMPLES, VoiceMixer
+
+ATYPE = AudioType.GEMINI_SEND
+FRAME_VALUES = ATYPE.value.bytes_per_ms * 20 // 2
+
+
+def frame(value: int) -> bytes:
+    return np.full(FRAME_VALUES, value, dtype=np.int16).tobytes()
+
+
+def collect():
+    out = []
+    return out, lambda pcm, received: out.append(np.frombuffer(pcm, dtype=np.int16).copy())
+
+
+def test_concurrent_speakers_are_summed_per_slot():
+    out, output = collect()
+    mixer = VoiceMixer(output, ATYPE)
+    for i in range(5):
+        # different RTP clocks, same moment
+        mixer.push(1, 1_000 * RTP_FRAME_SAMPLES + i * RTP_FRAME_SAMPLES, frame(100))
+        mixer.push(2, 77 * RTP_FRAME_SAMPLES + i * RTP_FRAME_SAMPLES, frame(20))
+    mixer.flush()
+    assert len(out) == 5
+    assert all((pcm == 120).all() for pcm in out)
+    assert mixer.mixed_frames == 5
+
+
+def test_sums_are_clipped():
+    out, output = collect()
+    mixer = VoiceMixer(output, ATYPE)
+    mixer.push(1, 0, frame(30_000))
+    mixer.push(2, 0, frame(30_000))
+    mixer.flush()
+    assert (out[0] == 32767).all()
+
+
+def test_a_forgotten_speaker_rejoins_without_a_resync():
+    out, output = collect()
+    mixer = VoiceMixer(output, ATYPE)
+    for i in range(3):
+        mixer.push(1, (500 + i) * RTP_FRAME_SAMPLES, frame(1))
+    # leaving ends the utterance
+    mixer.flush()
+    mixer.forget(1)
+    # a new RTP clock after rejoining
+    for i in range(3):
+        mixer.push(1, i * RTP_FRAME_SAMPLES, frame(2))
+    mixer.flush()
+    assert mixer.resyncs == 0
+    assert [int(pcm[0]) for pcm in out] == [1, 1, 1, 2, 2, 2]
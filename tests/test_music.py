@@ -0,0 +1,160 @@
+import asyncio
+import threading
+from dskek.music import GuildPlayer, Playlist, Track
+
+
+class FakeSource:
+    def __init__(self, query: str):
+        self.title = query
+        self.data = {"id": query}
+        self.cleaned = False
+
+    def cleanup(self):
+        self.cleaned = True
+
+
+class FakeVoiceClient:
+    def __init__(self):
+        self.source = None
+        self.after = None
+        self.played: list[str] = []
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return self.source is not None
+
+    def play(self, source, after):
+        self.source, self.after = source, after
+        self.played.append(source.title)
+
+    def stop(self):
+        # discord.py calls the after-callback from its player thread
+        if self.source is not None:
+            self.source, after = None, self.after
+            after(None)
+
+
+class FakeChannel:
+    def __init__(self):
+        self.messages: list[str] = []
+
+    async def send(self, text: str):
+        self.messages.append(text)
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def make_player(blocked: set[str] = frozenset(), **kwargs):
+    resolved = []
+    release = asyncio.Event()
+
+    async def resolve(query: str):
+        resolved.append(query)
+        if query in blocked:
+            await release.wait()
+        if query.startswith("bad"):
+            raise RuntimeError("unavailable")
+        return FakeSource(query)
+
+    return GuildPlayer(resolve, **kwargs), resolved, release
+
+
+def test_tracks_play_in_order_with_prefetch():
+    async def run():
+        started = []
+        player, resolved, _ = make_player(prefetch_depth=1, on_play=lambda source: started.append(source.title))
+        vc, channel = FakeVoiceClient(), FakeChannel()
+        assert player.enqueue(vc, channel, Track("a", "me")) == 0
+        assert player.enqueue(vc, channel, Track("bad", "me")) == 1
+        assert player.enqueue(vc, channel, Track("c", "me")) == 2
+        await settle()
+        assert vc.played == ["a"]
+        # the next one is resolving already, the one after isn't
+        assert resolved == ["a", "bad"]
+        vc.stop()
+        await settle()
+        assert vc.played == ["a", "c"]
+        assert started == ["a", "c"]
+        assert any("Skipping **bad**" in message for message in channel.messages)
+
+    asyncio.run(run())
+
+
+def test_skip_while_the_head_is_still_resolving():
+    async def run():
+        player, _, _ = make_player(blocked={"slow"})
+        vc = FakeVoiceClient()
+        player.enqueue(vc, FakeChannel(), Track("slow", "me"))
+        player.enqueue(vc, FakeChannel(), Track("next", "me"))
+        await settle()
+        assert vc.played == []
+        assert player.skip()
+        await settle()
+        assert vc.played == ["next"]
+
+    asyncio.run(run())
+
+
+def test_a_track_cancelled_elsewhere_does_not_stall_the_queue():
+    async def run():
+        player, _, _ = make_player(blocked={"slow"}, prefetch_depth=2)
+        vc = FakeVoiceClient()
+        player.enqueue(vc, FakeChannel(), Track("a", "me"))
+        slow = Track("slow", "me")
+        player.enqueue(vc, FakeChannel(), slow)
+        player.enqueue(vc, FakeChannel(), Track("c", "me"))
+        await settle()
+        vc.stop()
+        await settle()
+        slow.task.cancel()
+        await settle()
+        assert vc.played == ["a", "c"]
+
+    asyncio.run(run())
+
+
+def test_stop_cancels_the_advance():
+    async def run():
+        player, _, _ = make_player(blocked={"slow"})
+        vc = FakeVoiceClient()
+        player.enqueue(vc, FakeChannel(), Track("slow", "me"))
+        player.enqueue(vc, FakeChannel(), Track("next", "me"))
+        await settle()
+        player.stop()
+        await settle()
+        assert vc.played == []
+        assert not player.active
+
+    asyncio.run(run())
+
+
+def test_playlists_expand_a_few_entries_at_a_time():
+    async def run():
+        listed = 0
+
+        async def entries():
+            nonlocal listed
+            for i in range(100):
+                listed += 1
+                yield Track(f"p{i}", "me")
+
+        player, _, _ = make_player(prefetch_depth=1)
+        vc = FakeVoiceClient()
+        player.enqueue(vc, FakeChannel(), Playlist("mix", "me", entries(), threading.Event()))
+        player.enqueue(vc, FakeChannel(), Track("after", "me"))
+        await settle()
+        assert vc.played == ["p0"]
+        # only the prefetch window and the lookahead get listed
+        assert listed <= 4
+        player.clear()
+        await settle()
+        vc.stop()
+        await settle()
+        assert vc.played == ["p0"]
+
+    asyncio.run(run())
@@ -0,0 +1,38 @@
+import asyncio
+import aiohttp
+from aiohttp import web
+from dskek.proxy_clients import ConnectionPools, PoolConfig
+
+
+async def ok(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+def test_requests_reuse_the_shared_connector():
+    async def run():
+        app = web.Application()
+        app.router.add_get("/", ok)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+
+        pools = ConnectionPools({"test": PoolConfig()})
+        try:
+            # separate sessions, one pool
+            for _ in range(3):
+                async with aiohttp.ClientSession(
+                    connector=pools.connector("test"), connector_owner=False, trace_configs=[pools.trace("test")]
+                ) as session:
+                    async with session.get(f"http://127.0.0.1:{port}/") as response:
+                        assert await response.text() == "ok"
+        finally:
+            await pools.close()
+            await runner.cleanup()
+        return pools.stats["test"]
+
+    stats = asyncio.run(run())
+    assert stats.requests == 3
+    assert stats.created == 1
+    assert stats.reused == 2
@@ -0,0 +1,38 @@
+import threading
+from dskek.converters import AudioType, FramePool
+from dskek.receive import ReceiveWorkers
+
+
+class Recorder:
+    def __init__(self, expected: int):
+        self.items = []
+        self.expected = expected
+        self.done = threading.Event()
+        self.frames = FramePool(AudioType.GEMINI_SEND, 20, owner=self)
+
+    def process(self, items):
+        for item in items:
+            self.items.append(item if isinstance(item, tuple) else item.sequence)
+            if not isinstance(item, tuple):
+                item.release()
+        if len(self.items) >= self.expected:
+            self.done.set()
+
+
+def test_each_pipeline_sees_its_items_in_order():
+    workers = ReceiveWorkers(2)
+    pipelines = [Recorder(101), Recorder(101)]
+    assigned = [workers.assign() for _ in pipelines]
+    # spread over both workers
+    assert assigned[0] is not assigned[1]
+    for sequence in range(100):
+        for pipeline, worker in zip(pipelines, assigned):
+            frame = pipeline.frames.get()
+            frame.sequence = sequence
+            worker.submit_frame(frame)
+    for pipeline, worker in zip(pipelines, assigned):
+        worker.submit(pipeline, ("stop", 1))
+    for pipeline, worker in zip(pipelines, assigned):
+        assert pipeline.done.wait(5)
+        assert pipeline.items == [*range(100), ("stop", 1)]
+        workers.release(worker)
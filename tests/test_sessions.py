@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from dskek.sessions import SessionError, SessionManager
+
+
+class FakeVoiceClient:
+    def __init__(self):
+        self.connected = True
+        self.listening = False
+        self.playing = False
+        self.channel = SimpleNamespace(members=[SimpleNamespace(bot=False)])
+
+    def listen(self, sink):
+        self.listening = True
+
+    def play(self, source):
+        self.playing = True
+
+    def is_listening(self):
+        return self.listening
+
+    def stop_listening(self):
+        self.listening = False
+
+    def is_playing(self):
+        return self.playing
+
+    def stop(self):
+        self.playing = False
+
+    def is_connected(self):
+        return self.connected
+
+    async def disconnect(self, force=False):
+        self.connected = False
+
+
+class FakeChannel:
+    def __init__(self, guild_id: int, delay: float = 0):
+        self.guild = SimpleNamespace(id=guild_id)
+        self.delay = delay
+        self.clients: list[FakeVoiceClient] = []
+
+    async def connect(self, cls=None):
+        await asyncio.sleep(self.delay)
+        vc = FakeVoiceClient()
+        self.clients.append(vc)
+        return vc
+
+
+class FakeVoice:
+    def __init__(self, stream, fail: bool = False, ends: asyncio.Event | None = None):
+        if fail:
+            raise RuntimeError("no audio")
+        self.stream = stream
+        self.ends = ends
+        self.last_activity = 0
+
+    async def run(self):
+        if self.ends is None:
+            await asyncio.Event().wait()
+        await self.ends.wait()
+
+
+def test_joins_are_limited_and_not_duplicated():
+    async def run():
+        manager = SessionManager(FakeVoice, max_sessions=2)
+        slow = FakeChannel(1, delay=0.05)
+        first = asyncio.ensure_future(manager.start(slow))
+        await asyncio.sleep(0)
+        # the guild is reserved before the voice connect finishes
+        with pytest.raises(SessionError):
+            await manager.start(FakeChannel(1))
+        await manager.start(FakeChannel(2))
+        with pytest.raises(SessionError, match="busy"):
+            await manager.start(FakeChannel(3))
+        await first
+        assert len(slow.clients) == 1
+        assert manager.in_use == 2
+        await manager.shutdown()
+        assert len(manager) == 0
+        assert not slow.clients[0].is_connected()
+
+    asyncio.run(run())
+
+
+def test_a_failed_start_releases_the_guild():
+    async def run():
+        manager = SessionManager(lambda stream: FakeVoice(stream, fail=True))
+        channel = FakeChannel(1)
+        with pytest.raises(RuntimeError):
+            await manager.start(channel)
+        assert manager.in_use == 0
+        assert 1 not in manager.controller
+        assert not channel.clients[0].is_connected()
+
+    asyncio.run(run())
+
+
+def test_a_session_that_ends_is_stopped():
+    async def run():
+        ends = asyncio.Event()
+        manager = SessionManager(lambda stream: FakeVoice(stream, ends=ends))
+        channel = FakeChannel(1)
+        await manager.start(channel)
+        ends.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert 1 not in manager
+        assert not channel.clients[0].is_connected()
+        await manager.shutdown()
+
+    asyncio.run(run())
@@ -0,0 +1,22 @@
+import numpy as np
+from dskek.models import SpeechEvent
+from dskek.vad import VAD_HANGOVER_MS, SpeechGate
+
+FRAME_VALUES = 960 * 2
+LOUD = (np.ones(FRAME_VALUES) * 2_000).astype(np.int16).tobytes()
+QUIET = bytes(FRAME_VALUES * 2)
+
+
+def test_the_channel_starts_and_stops_talking_once():
+    gate = SpeechGate()
+    assert gate.update(1, QUIET) == (False, None)
+    assert gate.update(1, LOUD) == (True, SpeechEvent.START)
+    # a second speaker joins an ongoing utterance
+    assert gate.update(2, LOUD) == (True, None)
+    assert gate.drop(1) is None
+    # the hangover keeps a short pause inside the utterance
+    hangover = VAD_HANGOVER_MS // 20
+    for _ in range(hangover):
+        assert gate.update(2, QUIET) == (True, None)
+    assert gate.update(2, QUIET) == (False, SpeechEvent.END)
+    assert gate.speakers == set()
@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+import numpy as np
+import pytest
+from dskek.converters import AudioData, AudioType
+from dskek.models import SpeechEvent
+from dskek.voicebot import BARGE_IN_MIN_MS, VoiceBot, WakeWordGate
+
+FRAME_MS = 20
+
+
+def tone(millis: int = FRAME_MS, amplitude: int = 3_000) -> bytes:
+    samples = AudioType.DISCORD.value.bytes_per_ms * millis // 2
+    return (np.sin(np.arange(samples) / 5) * amplitude).astype(np.int16).tobytes()
+
+
+def frames(bot: VoiceBot, user_id: int, count: int, pcm: bytes, start: int = 0) -> list:
+    items = []
+    for i in range(start, start + count):
+        frame = bot.frames.get()
+        frame.user_id = user_id
+        frame.sequence = i
+        frame.timestamp = i * 960
+        frame.data = pcm
+        items.append(frame)
+    return items
+
+
+def upstream(bot: VoiceBot) -> list:
+    items = []
+    while not bot.stream.audio_in_queue.empty():
+        items.append(bot.stream.audio_in_queue.get_nowait())
+    return items
+
+
+def test_silence_is_gated_and_speech_is_sent():
+    async def run():
+        bot = VoiceBot(opus=False)
+        bot.process(frames(bot, 1, 10, bytes(len(tone()))))
+        assert upstream(bot) == []
+        bot.process(frames(bot, 1, 10, tone(), start=10))
+        bot.process([("stop", 1)])
+        items = upstream(bot)
+        assert items[0] is SpeechEvent.START
+        assert items[-1] is SpeechEvent.END
+        # the mixer and resampler hand over what they held once the utterance ends
+        sent = sum(item.duration_ms for item in items if isinstance(item, AudioData))
+        assert sent == FRAME_MS * 10
+        bot.cleanup()
+
+    asyncio.run(run())
+
+
+def test_short_sounds_do_not_cut_the_bot_off():
+    async def run():
+        bot = VoiceBot(opus=False)
+        short = BARGE_IN_MIN_MS // FRAME_MS - 1
+        bot.process(frames(bot, 1, short, tone()))
+        assert not bot.stream.cut_off
+        bot.process([("stop", 1)])
+        # a new utterance starts counting from zero
+        bot.process(frames(bot, 1, short, tone(), start=short))
+        assert not bot.stream.cut_off
+        bot.process(frames(bot, 1, 1, tone(), start=2 * short))
+        assert bot.stream.cut_off
+        assert bot.stream.take_interrupt()
+        bot.cleanup()
+
+    asyncio.run(run())
+
+
+def test_a_returning_speaker_starts_over():
+    async def run():
+        bot = VoiceBot(opus=False)
+        bot.process(frames(bot, 1, 5, tone(), start=1_000))
+        bot.process([("leave", 1)])
+        assert 1 not in bot.gate.speakers
+        assert 1 not in bot._sequences
+        # a new RTP clock doesn't count as lost packets or a mixer jump
+        bot.process(frames(bot, 1, 5, tone()))
+        assert bot.lost_packets == 0
+        assert bot.mixer.resyncs == 0
+        bot.cleanup()
+
+    asyncio.run(run())
+
+
+class FakeRecognizer:
+    def __init__(self, text: str):
+        self.text = text
+
+    def recognize(self, pcm: bytes, sample_rate: int) -> str:
+        return self.text
+
+
+def test_the_wake_word_opens_a_dialog_with_the_preroll(monkeypatch):
+    monkeypatch.setattr(WakeWordGate, "_recognizer", FakeRecognizer("ok Bot what time is it"))
+    woken = []
+    done = threading.Event()
+
+    def on_wake(user_id, preroll):
+        woken.append((user_id, preroll))
+        done.set()
+
+    gate = WakeWordGate(on_wake, wake_word="bot", preroll_ms=60)
+    assert not gate.in_dialog(1)
+    for timestamp in range(5):
+        gate.buffer(1, timestamp, tone())
+    gate.end_utterance(1)
+    assert done.wait(5)
+    # only the newest preroll_ms were kept
+    assert [timestamp for timestamp, _ in woken[0][1]] == [2, 3, 4]
+    assert gate.in_dialog(1)
+
+
+def test_other_speech_stays_local(monkeypatch):
+    monkeypatch.setattr(WakeWordGate, "_recognizer", FakeRecognizer("just chatting"))
+    gate = WakeWordGate(lambda *args: pytest.fail("woken"), wake_word="bot")
+    gate.buffer(1, 0, tone())
+    gate.end_utterance(1)
+    WakeWordGate._pool.submit(lambda: None).result()
+    for _ in range(100):
+        if 1 not in gate._recognizing:
+            break
+        time.sleep(0.01)
+    assert not gate.in_dialog(1)
@@ -0,0 +1,8 @@
+from dskek.youtube import is_playlist
+
+
+def test_playlist_urls_are_recognized():
+    assert is_playlist("https://www.youtube.com/playlist?list=PL123")
+    assert is_playlist("https://www.youtube.com/watch?v=abc&list=PL123")
+    assert not is_playlist("https://www.youtube.com/watch?v=abc")
+    assert not is_playlist("some search with list=words")
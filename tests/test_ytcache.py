@@ -0,0 +1,121 @@
+import asyncio
+import sqlite3
+import time
+from dskek import ytcache
+from dskek.ytcache import ExtractionCache, normalize_query
+
+
+def stream(expires_in: float = 3_600) -> dict:
+    return {"title": "song", "url": f"https://cdn.example/audio?expire={int(time.time() + expires_in)}"}
+
+
+def test_normalize_query_drops_tracking_and_aliases():
+    assert normalize_query("https://youtu.be/abc?si=x") == "youtube:abc"
+    assert normalize_query("https://m.youtube.com/watch?v=abc&feature=share") == "youtube:abc"
+    assert normalize_query("  Some   SONG ") == "search:some song"
+
+
+def test_concurrent_lookups_share_one_extraction():
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return stream()
+
+    async def run():
+        cache = ExtractionCache(None)
+        results = await asyncio.gather(*(cache.get("https://youtu.be/abc", fetch) for _ in range(5)))
+        assert all(result is results[0] for result in results)
+        assert await cache.get("https://www.youtube.com/watch?v=abc", fetch) is results[0]
+        return cache
+
+    cache = asyncio.run(run())
+    assert calls == 1
+    assert (cache.misses, cache.coalesced, cache.hits) == (1, 4, 1)
+
+
+def test_one_waiter_giving_up_keeps_the_extraction_for_the_others():
+    started = 0
+
+    async def fetch():
+        nonlocal started
+        started += 1
+        await asyncio.sleep(0.05)
+        return stream()
+
+    async def run():
+        cache = ExtractionCache(None)
+        first = asyncio.ensure_future(cache.get("q", fetch))
+        second = asyncio.ensure_future(cache.get("q", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert (await second)["title"] == "song"
+        # everyone gone: the extraction itself is cancelled
+        alone = asyncio.ensure_future(cache.get("other", fetch))
+        await asyncio.sleep(0.01)
+        task = cache._inflight["search:other"]
+        alone.cancel()
+        await asyncio.wait([task])
+        assert task.cancelled()
+        assert not cache._inflight
+
+    asyncio.run(run())
+    assert started == 2
+
+
+def test_disk_entries_survive_and_hits_are_written_in_batches(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite3")
+    monkeypatch.setattr(ytcache, "TOUCH_BATCH", 2)
+
+    async def fetch():
+        return stream()
+
+    async def first_run():
+        cache = ExtractionCache(path)
+        await cache.get("a", fetch)
+        await cache.get("b", fetch)
+
+    asyncio.run(first_run())
+
+    def last_used() -> dict:
+        with sqlite3.connect(path) as db:
+            return dict(db.execute("SELECT key, last_used FROM extractions"))
+
+    stored = last_used()
+
+    async def second_run():
+        cache = ExtractionCache(path)
+
+        async def unreachable():
+            raise AssertionError("should come from disk")
+
+        await cache.get("a", unreachable)
+        assert cache.disk_hits == 1
+        # a memory hit is queued too; the second touch fills the batch
+        await cache.get("a", unreachable)
+        assert cache.hits == 1
+        await cache.get("b", unreachable)
+        await cache._flushing
+        assert not cache._touched
+
+    asyncio.run(second_run())
+    assert all(last_used()[key] > stored[key] for key in stored)
+
+
+def test_expired_urls_are_not_served(tmp_path):
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        return stream(expires_in=ytcache.EXPIRY_MARGIN / 2)
+
+    async def run():
+        cache = ExtractionCache(str(tmp_path / "cache.sqlite3"))
+        await cache.get("q", fetch)
+        await cache.get("q", fetch)
+
+    asyncio.run(run())
+    assert calls == 2